@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+"""
+Load tests the demo form views over a local WSGI server.
+
+Seeds a SQLite database with the demo Author/Book models, serves MyFormView
+and MySecondFormView from a separate process and runs concurrent client
+threads mixing renders (GET) with valid and invalid submissions (POST).
+Reports the throughput, the p50/p99 latencies and the queries per request
+of each kind of request::
+
+    python benchmarks/load.py --rows 10000 --clients 8 --requests 200
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import timeit
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+try:
+    from socketserver import ThreadingMixIn
+    from http.client import HTTPConnection
+    from urllib.parse import urlencode
+except ImportError:
+    from SocketServer import ThreadingMixIn
+    from httplib import HTTPConnection
+    from urllib import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BOOKS_PER_AUTHOR = 100
+BATCH_SIZE = 500
+# Books submitted by the multiple selection requests
+SELECTED = 10
+
+# Name, weight, url, method
+SCENARIOS = (
+    ('render', 30, '/', 'GET'),
+    ('render multiple', 20, '/2/', 'GET'),
+    ('valid post', 20, '/', 'POST'),
+    ('invalid post', 10, '/', 'POST'),
+    ('valid multiple post', 15, '/2/', 'POST'),
+    ('invalid multiple post', 5, '/2/', 'POST'),
+)
+
+
+def setup(database):
+    from django.conf import settings
+    if settings.configured:
+        # Inherited by the forked server process
+        return
+    settings.configure(
+        DEBUG=False,
+        DATABASES={
+            'default': {
+                'NAME': database,
+                'ENGINE': 'django.db.backends.sqlite3',
+            },
+        },
+        INSTALLED_APPS=[
+            'django.contrib.contenttypes',
+            'django.contrib.auth',
+            'related_choice_field',
+            'demo.polls',
+        ],
+        ROOT_URLCONF='demo.polls.urls',
+        # Only the views are measured, and the posts carry no CSRF token
+        MIDDLEWARE_CLASSES=(),
+        MIDDLEWARE=[],
+        TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'APP_DIRS': True,
+        }],
+        ALLOWED_HOSTS=['*'],
+        SITE_ID=1,
+    )
+    import django
+    if hasattr(django, 'setup'):
+        django.setup()
+
+
+def populate(rows):
+    """
+    Creates ``rows`` books, BOOKS_PER_AUTHOR per author, and returns the
+    book ids by author id.
+    """
+    from django.core.management import call_command
+    from demo.polls.models import Author, Book
+    try:
+        call_command('migrate', run_syncdb=True, interactive=False,
+            verbosity=0)
+    except Exception:
+        call_command('syncdb', interactive=False, verbosity=0)
+    authors_count = (rows + BOOKS_PER_AUTHOR - 1) // BOOKS_PER_AUTHOR
+    Author.objects.bulk_create([
+        Author(name='Author %i' % i, title='MR')
+        for i in range(authors_count)])
+    author_ids = list(Author.objects.order_by('pk')
+        .values_list('pk', flat=True))
+    books = []
+    for i in range(rows):
+        books.append(Book(name='Book %i' % i,
+            author_id=author_ids[i // BOOKS_PER_AUTHOR]))
+        if len(books) == BATCH_SIZE:
+            Book.objects.bulk_create(books)
+            books = []
+    Book.objects.bulk_create(books)
+    books = {}
+    for pk, author_id in Book.objects.order_by() \
+            .values_list('pk', 'author'):
+        books.setdefault(author_id, []).append(pk)
+    return books
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def counting_application(application):
+    """
+    Wraps a WSGI application to report the queries of each request in an
+    X-Queries header.
+    """
+    from related_choice_field.instrumentation import QueryCounter
+
+    def wrapper(environ, start_response):
+        response = {}
+
+        def capture(status, headers, exc_info=None):
+            response['status'], response['headers'] = status, headers
+
+        with QueryCounter() as queries:
+            result = application(environ, capture)
+            try:
+                body = b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        start_response(response['status'], response['headers'] +
+            [(str('X-Queries'), str(queries.count))])
+        return [body]
+    return wrapper
+
+
+def serve(database, ready):
+    setup(database)
+    try:
+        from django.core.wsgi import get_wsgi_application
+        application = get_wsgi_application()
+    except ImportError:
+        from django.core.handlers.wsgi import WSGIHandler
+        application = WSGIHandler()
+    server = make_server('127.0.0.1', 0, counting_application(application),
+        server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    ready.put(server.server_port)
+    server.serve_forever()
+
+
+def get_request(scenario, books, rng):
+    """
+    Returns the url, method and body of a request of the given scenario.
+    """
+    name, weight, url, method = scenario
+    if method == 'GET':
+        return url, method, None
+    author = rng.choice(list(books))
+    other = rng.choice([pk for pk in books if pk != author])
+    if name == 'valid post':
+        data = [('author', author), ('book', rng.choice(books[author]))]
+    elif name == 'invalid post':
+        data = [('author', author), ('book', rng.choice(books[other]))]
+    else:
+        selected = rng.sample(books[author],
+            min(SELECTED, len(books[author])))
+        if name == 'invalid multiple post':
+            selected[-1] = rng.choice(books[other])
+        data = [('author', author)] + [('book', pk) for pk in selected]
+    return url, method, urlencode(data)
+
+
+def client(port, requests, books, seed, results):
+    rng = random.Random(seed)
+    weights = [scenario[1] for scenario in SCENARIOS]
+    for i in range(requests):
+        pick = rng.uniform(0, sum(weights))
+        for scenario in SCENARIOS:
+            pick -= scenario[1]
+            if pick <= 0:
+                break
+        url, method, body = get_request(scenario, books, rng)
+        headers = {}
+        if body is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection = HTTPConnection('127.0.0.1', port)
+        start = timeit.default_timer()
+        try:
+            connection.request(method, url, body, headers)
+            response = connection.getresponse()
+            response.read()
+        except Exception:
+            results.append((scenario[0], None, None, None))
+            continue
+        finally:
+            connection.close()
+        results.append((scenario[0], timeit.default_timer() - start,
+            response.status, int(response.getheader('X-Queries', 0))))
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[int(round(percent / 100 * (len(values) - 1)))]
+
+
+def summarize(name, results, elapsed):
+    latencies = [latency for n, latency, s, q in results if latency is not None]
+    errors = len([s for n, l, s, q in results if s is None or s >= 400])
+    summary = {
+        'case': name,
+        'requests': len(results),
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else None,
+        'p50': None,
+        'p99': None,
+        'queries': None,
+        'statuses': {},
+    }
+    if latencies:
+        summary['p50'] = percentile(latencies, 50)
+        summary['p99'] = percentile(latencies, 99)
+        summary['queries'] = sum(q for n, l, s, q in results
+            if l is not None) / len(latencies)
+    for n, latency, status, q in results:
+        if status is not None:
+            key = str(status)
+            summary['statuses'][key] = summary['statuses'].get(key, 0) + 1
+    return summary
+
+
+def run(rows, clients, requests, seed):
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, 'load.sqlite3')
+    setup(database)
+    books = populate(rows)
+    from django.db import connection
+    connection.close()
+
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(database, ready))
+    server.daemon = True
+    server.start()
+    try:
+        port = ready.get(timeout=60)
+        results = []
+        threads = [threading.Thread(target=client,
+                args=(port, requests, books, seed + i, results))
+            for i in range(clients)]
+        start = timeit.default_timer()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = timeit.default_timer() - start
+    finally:
+        server.terminate()
+        server.join()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    summaries = [summarize('all', results, elapsed)]
+    for scenario in SCENARIOS:
+        summaries.append(summarize(scenario[0],
+            [result for result in results if result[0] == scenario[0]],
+            elapsed))
+    return summaries
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            cwd=ROOT).decode('ascii').strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rows', type=int, default=10000,
+        help='number of books')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200,
+        help='requests per client')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file, stdout by default')
+    args = parser.parse_args(argv)
+
+    summaries = run(args.rows, args.clients, args.requests, args.seed)
+    for summary in summaries:
+        print('%-24s %5i requests %3i errors %8.1f req/s  p50 %.4fs  '
+            'p99 %.4fs  %.1f queries' % (summary['case'],
+            summary['requests'], summary['errors'],
+            summary['throughput'] or 0, summary['p50'] or 0,
+            summary['p99'] or 0, summary['queries'] or 0), file=sys.stderr)
+
+    import django
+    report = {
+        'revision': get_revision(),
+        'python': sys.version.split()[0],
+        'django': django.get_version(),
+        'rows': args.rows,
+        'clients': args.clients,
+        'results': summaries,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
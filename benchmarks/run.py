@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""
+Benchmarks the related choice fields on the demo Author/Book models.
+
+Times the construction of the forms, RelatedSelect.render,
+MultipleRelatedSelect.render, both clean methods and, on Django >= 1.11,
+the template based rendering of the stock Select against SQLite databases
+of growing size and records, for each case, the best time, the number of
+queries, the peak memory and the output size as JSON so runs can be
+compared between commits::
+
+    python benchmarks/run.py --output before.json
+    python benchmarks/run.py --output after.json --compare before.json
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from django.conf import settings
+
+settings.configure(
+    DEBUG=True,
+    DATABASES={
+        'default': {
+            'NAME': ':memory:',
+            'ENGINE': 'django.db.backends.sqlite3',
+        },
+    },
+    INSTALLED_APPS=[
+        'django.contrib.contenttypes',
+        'django.contrib.auth',
+        'related_choice_field',
+        'demo.polls',
+    ],
+    SITE_ID=1,
+)
+
+import django
+if hasattr(django, 'setup'):
+    django.setup()
+
+from django import forms
+from django.core.management import call_command
+from django.db import connection, reset_queries
+from django.utils.datastructures import MultiValueDict
+
+from related_choice_field.compat import TEMPLATE_WIDGETS, force_text
+from demo.polls.models import Author, Book
+from demo.polls.views import BookSelectionForm, MultiBookSelectionForm
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+DEFAULT_SELECTIONS = (1, 100, 5000)
+BOOKS_PER_AUTHOR = 100
+BATCH_SIZE = 500
+# Forms built by the construction case, as in a large formset
+FORMS = 100
+
+
+def create_tables():
+    try:
+        call_command('migrate', run_syncdb=True, interactive=False,
+            verbosity=0)
+    except Exception:
+        call_command('syncdb', interactive=False, verbosity=0)
+
+
+def populate(size, selections):
+    """
+    Creates ``size`` books in a new database. The first author gets the
+    largest selection so it can be submitted as a whole, the others
+    BOOKS_PER_AUTHOR books each.
+    """
+    # A new in-memory database is faster than deleting the previous rows
+    connection.close()
+    create_tables()
+    first = min(size, max(selections))
+    authors_count = 1 + (size - first + BOOKS_PER_AUTHOR - 1) // BOOKS_PER_AUTHOR
+    Author.objects.bulk_create([
+        Author(name='Author %i' % i, title='MR')
+        for i in range(authors_count)])
+    author_ids = list(Author.objects.order_by('pk')
+        .values_list('pk', flat=True))
+    books = []
+    for i in range(size):
+        if i < first:
+            author_id = author_ids[0]
+        else:
+            author_id = author_ids[1 + (i - first) // BOOKS_PER_AUTHOR]
+        books.append(Book(name='Book %i' % i, author_id=author_id))
+        if len(books) == BATCH_SIZE:
+            Book.objects.bulk_create(books)
+            books = []
+    Book.objects.bulk_create(books)
+    return author_ids[0]
+
+
+def measure(func, repeat):
+    """
+    Returns the best time, the queries, the peak memory and the output
+    size of ``func``.
+    """
+    times = []
+    for i in range(repeat):
+        gc.collect()
+        start = timeit.default_timer()
+        func()
+        times.append(timeit.default_timer() - start)
+
+    reset_queries()
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+    output = func()
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        'time': min(times),
+        'queries': len(connection.queries),
+        'peak_memory': peak,
+        'output_size': len(output.encode('utf-8')) if output else None,
+    }
+
+
+def get_cases(author_id, selections):
+    author = str(author_id)
+    books = [str(pk) for pk in Book.objects.filter(author_id=author_id)
+        .order_by('pk').values_list('pk', flat=True)]
+    field = BookSelectionForm.base_fields['book']
+    multiple_field = MultiBookSelectionForm.base_fields['book']
+
+    def construct(form_class):
+        return lambda: [form_class() for i in range(FORMS)] and None
+
+    def render(data):
+        return lambda: force_text(BookSelectionForm(data)['book'])
+
+    def render_multiple(data):
+        return lambda: force_text(MultiBookSelectionForm(data)['book'])
+
+    def clean(value):
+        return lambda: field.clean(value) and None
+
+    def clean_multiple(value):
+        return lambda: len(multiple_field.clean(value)) and None
+
+    cases = [
+        ('BookSelectionForm()', FORMS, construct(BookSelectionForm)),
+        ('MultiBookSelectionForm()', FORMS,
+            construct(MultiBookSelectionForm)),
+        ('RelatedSelect.render', 1,
+            render({'author': author, 'book': books[0]})),
+        ('RelatedModelChoiceField.clean', 1,
+            clean((books[0], author))),
+    ]
+    if TEMPLATE_WIDGETS:
+        # The stock widget renders a template per option
+        stock_field = forms.ModelChoiceField(queryset=Book.objects.all())
+        cases.append(('Select.render (template)', 1,
+            lambda: stock_field.widget.render('book', books[0])))
+    for selected in selections:
+        if selected > len(books):
+            continue
+        values = books[:selected]
+        cases.append(('MultipleRelatedSelect.render', selected,
+            render_multiple(MultiValueDict({
+                'author': [author], 'book': values}))))
+        cases.append(('RelatedModelMultipleChoiceField.clean', selected,
+            clean_multiple(tuple((value, author) for value in values))))
+    return cases
+
+
+def run(sizes, selections, repeat):
+    results = []
+    for size in sizes:
+        author_id = populate(size, selections)
+        for name, selected, func in get_cases(author_id, selections):
+            result = measure(func, repeat)
+            result.update({'case': name, 'rows': size, 'selected': selected})
+            results.append(result)
+            print('%-40s rows=%-8i selected=%-5i %.4fs %i queries' % (
+                name, size, selected, result['time'], result['queries']),
+                file=sys.stderr)
+    return results
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            cwd=ROOT).decode('ascii').strip()
+    except Exception:
+        return None
+
+
+def compare(results, previous):
+    """
+    Prints the time ratio of every case against a previous run.
+    """
+    def key(result):
+        return (result['case'], result['rows'], result['selected'])
+    before = dict((key(result), result) for result in previous['results'])
+    for result in results:
+        old = before.get(key(result))
+        if old is None or not old['time']:
+            continue
+        print('%-40s rows=%-8i selected=%-5i x%.2f (%i -> %i queries)' % (
+            result['case'], result['rows'], result['selected'],
+            result['time'] / old['time'], old['queries'], result['queries']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--selections', type=int, nargs='+',
+        default=DEFAULT_SELECTIONS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='JSON file, stdout by default')
+    parser.add_argument('--compare', help='JSON file of a previous run')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.selections, args.repeat)
+    report = {
+        'revision': get_revision(),
+        'python': sys.version.split()[0],
+        'django': django.get_version(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(results, json.load(previous))
+
+
+if __name__ == '__main__':
+    main()
@@ -26,6 +26,12 @@ def pytest_configure(config):
         DEBUG=False,
         SITE_ID=1,
         TEMPLATE_DEBUG=True,
+        # Django >= 1.8
+        TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'APP_DIRS': True,
+        }],
         # TEMPLATE_DIRS=[os.path.join(where_am_i, 'tests', 'contrib', 'django', 'templates')],
         ALLOWED_HOSTS=['*'],
+        RELATED_CHOICE_FIELD_INVALIDATED_MODELS=[('polls.City', 'region')],
     )
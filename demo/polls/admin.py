@@ -1,4 +1,4 @@
-from polls.models import Book, Author
+from .models import Book, Author
 from django.contrib import admin
 
 
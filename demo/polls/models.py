@@ -1,4 +1,10 @@
 from django.db import models
+try:
+    from django.utils.encoding import python_2_unicode_compatible
+except ImportError:
+    # Django >= 3.0 only runs on Python 3
+    def python_2_unicode_compatible(klass):
+        return klass
 
 TITLE_CHOICES = (
     ('MR', 'Mr.'),
@@ -7,18 +13,59 @@ TITLE_CHOICES = (
 )
 
 
+@python_2_unicode_compatible
 class Author(models.Model):
     name = models.CharField(max_length=100)
     title = models.CharField(max_length=3, choices=TITLE_CHOICES)
     birth_date = models.DateField(blank=True, null=True)
 
-    def __unicode__(self):
+    def __str__(self):
         return self.name
 
 
+@python_2_unicode_compatible
 class Book(models.Model):
     name = models.CharField(max_length=100)
-    author = models.ForeignKey(Author, related_name='books')
+    author = models.ForeignKey(Author, related_name='books',
+        on_delete=models.CASCADE)
 
-    def __unicode__(self):
+    def __str__(self):
+        return self.name
+
+
+@python_2_unicode_compatible
+class Article(models.Model):
+    name = models.CharField(max_length=100)
+    author = models.ForeignKey(Author, related_name='articles',
+        blank=True, null=True, on_delete=models.CASCADE)
+
+    def __str__(self):
+        return self.name
+
+
+@python_2_unicode_compatible
+class Country(models.Model):
+    name = models.CharField(max_length=100)
+
+    def __str__(self):
+        return self.name
+
+
+@python_2_unicode_compatible
+class Region(models.Model):
+    name = models.CharField(max_length=100)
+    country = models.ForeignKey(Country, related_name='regions',
+        on_delete=models.CASCADE)
+
+    def __str__(self):
+        return self.name
+
+
+@python_2_unicode_compatible
+class City(models.Model):
+    name = models.CharField(max_length=100)
+    region = models.ForeignKey(Region, related_name='cities',
+        on_delete=models.CASCADE)
+
+    def __str__(self):
         return self.name
@@ -0,0 +1,17 @@
+from rest_framework import serializers
+
+from .models import Book, Author
+from related_choice_field.serializers import RelatedPrimaryKeyField
+from related_choice_field.serializers import RelatedListSerializer
+
+
+class BookSelectionSerializer(serializers.Serializer):
+    author = serializers.PrimaryKeyRelatedField(
+        queryset=Author.objects.all())
+    book = RelatedPrimaryKeyField(
+        queryset=Book.objects.all(),
+        related_field_name='author',
+        related_model_name='author')
+
+    class Meta:
+        list_serializer_class = RelatedListSerializer
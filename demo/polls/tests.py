@@ -4,12 +4,61 @@ when you run "manage.py test".
 
 Replace this with more appropriate tests for your application.
 """
+import json
+import os
+import re
+import tempfile
+
+import django
 import pytest
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
-from django.test import TestCase
+from django import forms
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.forms.formsets import formset_factory
+from django.test import TestCase, TransactionTestCase
+from django.utils.datastructures import MultiValueDict
 from django.test.client import Client
 
-from .models import Author, Book
+from related_choice_field.bulk import validate_pairs
+from related_choice_field.cache import get_versions
+from related_choice_field.compat import TEMPLATE_WIDGETS
+from related_choice_field.fields import RelatedModelChoiceField
+from related_choice_field.fields import RelatedValuesChoiceIterator
+from related_choice_field.fields import stream_bound_field
+from related_choice_field.forms import BaseRelatedChoiceFormSet
+from related_choice_field.forms import share_related_choices
+from related_choice_field.instrumentation import measured
+try:
+    from related_choice_field.async_views import ChoiceLoader
+except (ImportError, SyntaxError):
+    ChoiceLoader = None
+try:
+    from .serializers import BookSelectionSerializer
+except ImportError:
+    BookSelectionSerializer = None
+
+from .models import Author, Book, Article, Country, Region, City
+from .views import FilteredBookSelectionForm, CachedBookSelectionForm
+from .views import CachedArticleSelectionForm
+from .views import MultiBookSelectionForm, BookSelectionForm
+from .views import CitySelectionForm, ValuesBookSelectionForm
+from .views import TypeaheadBookSelectionForm, GroupedBookSelectionForm
+from .views import JsonBookSelectionForm, PairedBookSelectionForm
+
+
+def assert_form_error(test, response, field, error):
+    if django.VERSION >= (4, 1):
+        test.assertFormError(response.context['form'], field, error)
+    else:
+        # Removed in Django 5.0
+        test.assertFormError(response, 'form', field, error)
 
 
 @pytest.fixture
@@ -67,6 +116,14 @@ class LinkedModelChoiceFieldTest(TestCase):
         for choice in choices:
             self.assertContains(response, choice)
 
+    def test_cascade_wiring(self):
+        client = Client()
+        response = client.get(self.URL)
+        self.assertContains(response, 'data-related-parent="id_author"')
+        self.assertContains(response,
+            'related_choice_field/js/related_select.js', count=1)
+        self.assertNotContains(response, 'cascadeSelect')
+
     def test_submit_valid_form(self):
         client = Client()
         AUTHOR_ID = 1
@@ -98,7 +155,7 @@ class LinkedModelChoiceFieldTest(TestCase):
             'book': BOOK_ID,
         })
         self.assertEqual(response.status_code, 200)
-        self.assertFormError(response, 'form', 'book',
+        assert_form_error(self, response, 'book',
             'Value does not match author value.')
 
 
@@ -153,5 +210,947 @@ class LinkedModelMultipleChoiceFieldTest(TestCase):
             'book': BOOK_ID,
         })
         self.assertEqual(response.status_code, 200)
-        self.assertFormError(response, 'form', 'book',
-            'Select a valid choice. %i is not one of the available choices.' % BOOK_ID)
+        assert_form_error(self, response, 'book',
+            'Select a valid choice. %i is not one of the available choices.'
+            % BOOK_ID)
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class LazyRelatedChoicesTest(TestCase):
+
+    URL = '/lazy/'
+    CHOICES_URL = '/books/'
+
+    def test_html_output(self):
+        client = Client()
+        response = client.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response,
+            '<option value="" class="static">---------</option>')
+        self.assertNotContains(response, 'class="sub_')
+        self.assertContains(response, 'data-related-url="/books/"')
+
+    def test_html_output_with_known_parent(self):
+        client = Client()
+        response = client.post(self.URL, {
+            'author': 1,
+            'book': 4,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response,
+            '<option value="1" class="sub_1">La Fortune des Rougon</option>')
+        self.assertNotContains(response, 'Le Rouge et le Noir')
+
+    def test_choices_for_parent(self):
+        client = Client()
+        response = client.get(self.CHOICES_URL, {'parent': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), [
+            ['4', 'Le Rouge et le Noir'],
+            ['5', 'La Chartreuse de Parme'],
+        ])
+
+    def test_choices_for_invalid_parent(self):
+        client = Client()
+        response = client.get(self.CHOICES_URL, {'parent': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class FilteredOnParentTest(TestCase):
+
+    def test_html_output_without_parent(self):
+        html = str(FilteredBookSelectionForm()['book'])
+        self.assertIn('La Fortune des Rougon', html)
+        self.assertIn('Le Rouge et le Noir', html)
+
+    def test_html_output_with_initial_parent(self):
+        form = FilteredBookSelectionForm(initial={'author': 2})
+        html = str(form['book'])
+        self.assertNotIn('La Fortune des Rougon', html)
+        self.assertIn(
+            '<option value="4" class="sub_2">Le Rouge et le Noir</option>',
+            html)
+
+    def test_html_output_with_bound_parent(self):
+        form = FilteredBookSelectionForm({'author': '1', 'book': '1'})
+        html = str(form['book'])
+        self.assertIn('<option value="1" selected="selected" class="sub_1">'
+            'La Fortune des Rougon</option>', html)
+        self.assertNotIn('Le Rouge et le Noir', html)
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class CachedOptionsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_html_output(self):
+        html = str(CachedBookSelectionForm()['book'])
+        choices = (
+            '<option value="" class="static">---------</option>',
+            '<option value="1" class="sub_1">La Fortune des Rougon</option>',
+            '<option value="5" class="sub_2">La Chartreuse de Parme</option>',
+        )
+        for choice in choices:
+            self.assertIn(choice, html)
+
+    def test_cached_rendering(self):
+        str(CachedBookSelectionForm()['book'])
+        # Only the parents are queried once the options are cached
+        with self.assertNumQueries(1):
+            html = str(CachedBookSelectionForm()['book'])
+        self.assertIn('La Fortune des Rougon', html)
+
+    def test_selected_option(self):
+        str(CachedBookSelectionForm()['book'])
+        form = CachedBookSelectionForm({'author': '2', 'book': '4'})
+        html = str(form['book'])
+        self.assertIn('<option value="4" selected="selected" class="sub_2">'
+            'Le Rouge et le Noir</option>', html)
+        self.assertEqual(html.count('selected="selected"'), 1)
+
+    def test_invalidation(self):
+        str(CachedBookSelectionForm()['book'])
+        book = Book.objects.get(id=4)
+        book.name = 'Armance'
+        book.save()
+        html = str(CachedBookSelectionForm()['book'])
+        self.assertIn('<option value="4" class="sub_2">Armance</option>',
+            html)
+        self.assertNotIn('Le Rouge et le Noir', html)
+
+    def test_invalidation_of_previous_parent(self):
+        str(CachedBookSelectionForm()['book'])
+        book = Book.objects.get(id=4)
+        book.author_id = 1
+        book.save()
+        html = str(CachedBookSelectionForm()['book'])
+        self.assertIn('<option value="4" class="sub_1">', html)
+        self.assertNotIn('<option value="4" class="sub_2">', html)
+
+    @pytest.mark.skipif(django.VERSION < (1, 7),
+        reason="requires the app registry of Django >= 1.7")
+    def test_registered_invalidation(self):
+        # Connected at startup from RELATED_CHOICE_FIELD_INVALIDATED_MODELS,
+        # no form caching the cities being declared
+        region = Region.objects.create(name="Brittany",
+            country=Country.objects.create(name="France"))
+        version = get_versions(City, 'region', [region.pk])[region.pk]
+        City.objects.create(name="Rennes", region=region)
+        self.assertNotEqual(
+            get_versions(City, 'region', [region.pk])[region.pk], version)
+
+    def test_fields_rendering_differently(self):
+        class NamedBookSelectionForm(forms.Form):
+            book = RelatedModelChoiceField(
+                queryset=Book.objects.all(),
+                related_form_field_name='author',
+                related_model_name='author',
+                to_field_name='name',
+                cache_options=True)
+
+        class LabelledBookSelectionForm(forms.Form):
+            book = RelatedModelChoiceField(
+                queryset=Book.objects.all(),
+                related_form_field_name='author',
+                related_model_name='author',
+                label_field='name',
+                cache_options=True)
+            book.label_from_instance = lambda obj: obj.name.upper()
+
+        html = str(CachedBookSelectionForm()['book'])
+        self.assertIn('<option value="1" class="sub_1">', html)
+        html = str(NamedBookSelectionForm()['book'])
+        self.assertIn('<option value="La Curee" class="sub_1">', html)
+        self.assertNotIn('<option value="1" ', html)
+        html = str(LabelledBookSelectionForm()['book'])
+        self.assertIn('<option value="1" class="sub_1">', html)
+
+    def test_children_without_parent(self):
+        author = Author.objects.get(pk=1)
+        Article.objects.create(name='J\'accuse', author=author)
+        Article.objects.create(name='Anonymous', author=None)
+        field = CachedArticleSelectionForm.base_fields['article']
+        field.widget.cache_options = False
+        try:
+            uncached = str(CachedArticleSelectionForm()['article'])
+        finally:
+            field.widget.cache_options = True
+        for i in range(2):
+            html = str(CachedArticleSelectionForm()['article'])
+            self.assertIn('class="sub_None">Anonymous</option>', html)
+            self.assertEqual(sorted(html.splitlines()),
+                sorted(uncached.splitlines()))
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class BulkMultipleCleanTest(TestCase):
+
+    def get_field(self, chunk_size=None):
+        field = MultiBookSelectionForm().fields['book']
+        if chunk_size:
+            field.chunk_size = chunk_size
+        return field
+
+    def test_clean(self):
+        field = self.get_field()
+        # The children are fetched once, with their parent
+        with self.assertNumQueries(1):
+            books = field.clean((('1', '1'), ('2', '1'), ('3', '1')))
+        with self.assertNumQueries(0):
+            self.assertEqual(sorted(book.pk for book in books), [1, 2, 3])
+            self.assertEqual([book.author_id for book in books], [1, 1, 1])
+
+    def test_clean_in_chunks(self):
+        field = self.get_field(chunk_size=2)
+        with self.assertNumQueries(2):
+            books = field.clean((('1', '1'), ('2', '1'), ('3', '1')))
+        self.assertEqual(sorted(book.pk for book in books), [1, 2, 3])
+
+    def test_clean_invalid_pk_value(self):
+        field = self.get_field()
+        with self.assertRaises(ValidationError) as context:
+            field.clean((('1', '1'), ('abc', '1')))
+        self.assertEqual(context.exception.messages,
+            ['"abc" is not a valid value for a primary key.'])
+
+    def test_clean_non_consistent_choices(self):
+        field = self.get_field(chunk_size=1)
+        with self.assertRaises(ValidationError) as context:
+            field.clean((('1', '1'), ('4', '1')))
+        self.assertEqual(context.exception.messages,
+            ['Select a valid choice. 4 is not one of the available choices.'])
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class SingleQueryCleanTest(TestCase):
+
+    def get_field(self, **kwargs):
+        field = BookSelectionForm().fields['book']
+        for name, value in kwargs.items():
+            setattr(field, name, value)
+        return field
+
+    def test_clean(self):
+        field = self.get_field()
+        with self.assertNumQueries(1):
+            book = field.clean(('1', '1'))
+        self.assertEqual(book.pk, 1)
+
+    def test_clean_select_related_parent(self):
+        field = self.get_field(select_related_parent=True,
+            only_fields=('name', 'author__name'))
+        with self.assertNumQueries(1):
+            book = field.clean(('4', '2'))
+            self.assertEqual(book.name, 'Le Rouge et le Noir')
+            self.assertEqual(book.author.name, 'Marie-Henri Beyle (Stendhal)')
+
+    def test_clean_non_consistent_choices(self):
+        field = self.get_field()
+        with self.assertRaises(ValidationError) as context:
+            field.clean(('4', '1'))
+        self.assertEqual(context.exception.messages,
+            ['Value does not match author value.'])
+
+    def test_clean_invalid_parent_value(self):
+        field = self.get_field()
+        for related_value in ('abc', '', None):
+            with self.assertRaises(ValidationError) as context:
+                field.clean(('4', related_value))
+            self.assertEqual(context.exception.messages,
+                ['Value does not match author value.'])
+
+    def test_clean_invalid_choice(self):
+        field = self.get_field()
+        for value in ('42', 'abc'):
+            with self.assertRaises(ValidationError) as context:
+                field.clean((value, '1'))
+            self.assertEqual(context.exception.messages,
+                [field.error_messages['invalid_choice']])
+
+    def test_malformed_value(self):
+        for author in ('', '1'):
+            form = BookSelectionForm({'author': author, 'book': 'abc'})
+            self.assertFalse(form.is_valid())
+            self.assertEqual(form.errors['book'], [BookSelectionForm
+                .base_fields['book'].error_messages['invalid_choice']])
+            if hasattr(form, 'has_error'):
+                # Django >= 1.8
+                self.assertTrue(form.has_error('book', 'invalid_choice'))
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class FormSetValidationTest(TestCase):
+
+    def get_formset(self, pairs):
+        FormSet = formset_factory(BookSelectionForm,
+            formset=BaseRelatedChoiceFormSet, extra=0)
+        data = {
+            'form-TOTAL_FORMS': str(len(pairs)),
+            'form-INITIAL_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+        }
+        for i, (author, book) in enumerate(pairs):
+            data['form-%i-author' % i] = author
+            data['form-%i-book' % i] = book
+        return FormSet(data)
+
+    def test_valid_formset(self):
+        formset = self.get_formset([('1', '1'), ('1', '2'), ('2', '4')])
+        # One query for the books, the authors are still checked by form
+        with self.assertNumQueries(4):
+            self.assertTrue(formset.is_valid())
+        self.assertEqual(
+            [form.cleaned_data['book'].pk for form in formset.forms],
+            [1, 2, 4])
+
+    def test_non_consistent_choices(self):
+        formset = self.get_formset([('1', '1'), ('1', '4'), ('2', '42')])
+        self.assertFalse(formset.is_valid())
+        self.assertEqual(formset.errors[0], {})
+        self.assertEqual(formset.errors[1]['book'],
+            ['Value does not match author value.'])
+        self.assertEqual(formset.errors[2]['book'],
+            [BookSelectionForm.base_fields['book']
+                .error_messages['invalid_choice']])
+
+    def test_per_form_querysets(self):
+        class RestrictedFormSet(BaseRelatedChoiceFormSet):
+            def _construct_form(self, i, **kwargs):
+                form = super(RestrictedFormSet, self)._construct_form(
+                    i, **kwargs)
+                if i == 1:
+                    form.fields['book'].queryset = Book.objects.filter(pk=1)
+                return form
+
+        FormSet = formset_factory(BookSelectionForm,
+            formset=RestrictedFormSet, extra=0)
+        formset = FormSet({
+            'form-TOTAL_FORMS': '2',
+            'form-INITIAL_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+            'form-0-author': '1',
+            'form-0-book': '2',
+            'form-1-author': '1',
+            'form-1-book': '2',
+        })
+        # One query for the books of each queryset
+        with self.assertNumQueries(4):
+            self.assertFalse(formset.is_valid())
+        self.assertEqual(formset.errors[0], {})
+        self.assertEqual(formset.errors[1]['book'],
+            [BookSelectionForm.base_fields['book']
+                .error_messages['invalid_choice']])
+
+    def test_shared_choices_rendering(self):
+        formset = self.get_formset([('1', '1'), ('1', '2'), ('2', '4')])
+        # One query for the books, the authors are still queried by form
+        self.assertTrue(formset.is_valid())
+        with self.assertNumQueries(4):
+            html = formset.as_p()
+        self.assertEqual(html.count('La Fortune des Rougon'), 3)
+
+    def test_shared_choices_per_queryset(self):
+        forms = [BookSelectionForm(), BookSelectionForm()]
+        forms[1].fields['book'].queryset = Book.objects.filter(pk=1)
+        share_related_choices(forms)
+        self.assertIn('La Curee', str(forms[0]['book']))
+        self.assertIn('La Fortune des Rougon', str(forms[1]['book']))
+        self.assertNotIn('La Curee', str(forms[1]['book']))
+
+
+@pytest.fixture
+def load_chain_fixtures():
+    france = Country.objects.get_or_create(name="France")[0]
+    italy = Country.objects.get_or_create(name="Italy")[0]
+    brittany = Region.objects.get_or_create(name="Brittany", country=france)[0]
+    tuscany = Region.objects.get_or_create(name="Tuscany", country=italy)[0]
+    City.objects.get_or_create(name="Rennes", region=brittany)
+    City.objects.get_or_create(name="Florence", region=tuscany)
+
+
+@pytest.mark.usefixtures("load_chain_fixtures")
+class RelatedChainTest(TestCase):
+
+    def get_form(self, country, region, city):
+        return CitySelectionForm({
+            'country': str(country.pk),
+            'region': str(region.pk),
+            'city': str(city.pk),
+        })
+
+    def test_valid_chain(self):
+        form = self.get_form(Country.objects.get(name="France"),
+            Region.objects.get(name="Brittany"), City.objects.get(name="Rennes"))
+        # The country field runs its own query, the chain a single one
+        with self.assertNumQueries(2):
+            self.assertTrue(form.is_valid())
+            self.assertEqual(form.cleaned_data['region'].name, 'Brittany')
+            self.assertEqual(form.cleaned_data['city'].name, 'Rennes')
+
+    def test_non_consistent_chain(self):
+        form = self.get_form(Country.objects.get(name="Italy"),
+            Region.objects.get(name="Brittany"), City.objects.get(name="Rennes"))
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['region'],
+            ['Value does not match country value.'])
+        self.assertNotIn('city', form.errors)
+
+    def test_html_output(self):
+        form = CitySelectionForm()
+        self.assertIn('data-related-parent="id_region"', str(form['city']))
+        self.assertIn('data-related-parent="id_country"', str(form['region']))
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class StreamingTest(TestCase):
+
+    def test_stream_matches_render(self):
+        for form in (BookSelectionForm(),
+                BookSelectionForm({'author': '2', 'book': '4'}),
+                MultiBookSelectionForm({'author': '1', 'book': ['1', '2']})):
+            self.assertEqual(''.join(stream_bound_field(form['book'])),
+                str(form['book']))
+
+    def test_stream_chunks(self):
+        chunks = list(stream_bound_field(BookSelectionForm()['book'],
+            chunk_size=2))
+        # Opening tag, 6 options by 2 and closing tag
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(chunks[1],
+            '<option value="" class="static">---------</option>\n'
+            '<option value="1" class="sub_1">La Fortune des Rougon</option>\n')
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class ValuesChoiceIteratorTest(TestCase):
+
+    def test_html_output(self):
+        for data in (None, {'author': '2', 'book': '4'}):
+            self.assertEqual(str(ValuesBookSelectionForm(data)['book']),
+                str(BookSelectionForm(data)['book']))
+
+    def test_lazy_choices(self):
+        with self.assertNumQueries(0):
+            form = ValuesBookSelectionForm()
+        self.assertIsInstance(form.fields['book'].widget.choices,
+            RelatedValuesChoiceIterator)
+
+    def test_no_model_instances(self):
+        choices = list(ValuesBookSelectionForm().fields['book'].choices)
+        self.assertEqual(choices[:2], [
+            ('', '---------'),
+            ((1, 1), 'La Fortune des Rougon'),
+        ])
+
+    def test_clean(self):
+        form = ValuesBookSelectionForm({'author': '2', 'book': '4'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['book'], Book.objects.get(pk=4))
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class RenderOptionTest(TestCase):
+
+    def test_initial_instance_is_selected(self):
+        form = BookSelectionForm(initial={'book': Book.objects.get(pk=4)})
+        self.assertIn('<option value="4" selected="selected" class="sub_2">'
+            'Le Rouge et le Noir</option>', str(form['book']))
+
+    def test_multiple_selection(self):
+        form = MultiBookSelectionForm(
+            MultiValueDict({'author': ['1'], 'book': ['1', '3']}))
+        html = str(form['book'])
+        self.assertEqual(html.count('selected="selected"'), 2)
+        self.assertIn('<option value="3" selected="selected" class="sub_1">'
+            'Le Ventre de Paris</option>', html)
+
+    def test_escaping(self):
+        widget = BookSelectionForm().fields['book'].widget
+        self.assertEqual(
+            widget.render_option(set(), ('"a"', '<b>'), 'R&D'),
+            '<option value="&quot;a&quot;" class="sub_&lt;b&gt;">'
+            'R&amp;D</option>')
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class InstrumentationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.measures = []
+        measured.connect(self.receiver)
+
+    def tearDown(self):
+        measured.disconnect(self.receiver)
+
+    def receiver(self, sender, **kwargs):
+        self.measures.append(kwargs)
+
+    def test_render(self):
+        html = str(BookSelectionForm()['book'])
+        self.assertEqual([m['operation'] for m in self.measures],
+            ['render_options', 'render'])
+        measure = self.measures[-1]
+        self.assertEqual(measure['option_count'], 6)
+        self.assertEqual(measure['bytes'], len(html))
+        self.assertEqual(measure['queries'], 1)
+        self.assertEqual(measure['cache_hits'], None)
+        self.assertTrue(measure['duration'] >= 0)
+
+    def test_cache_hits(self):
+        str(CachedBookSelectionForm()['book'])
+        str(CachedBookSelectionForm()['book'])
+        self.assertEqual(self.measures[-1]['cache_hits'], 2)
+        self.assertEqual(self.measures[-1]['queries'], 1)
+
+    def test_clean(self):
+        field = MultiBookSelectionForm().fields['book']
+        field.clean((('1', '1'), ('2', '1')))
+        self.assertEqual(self.measures[-1]['operation'], 'clean')
+        self.assertEqual(self.measures[-1]['option_count'], 2)
+        self.assertEqual(self.measures[-1]['queries'], 1)
+        self.assertEqual(self.measures[-1]['exception'], None)
+
+    def test_failed_clean(self):
+        form = BookSelectionForm({'author': '1', 'book': '4'})
+        self.assertFalse(form.is_valid())
+        measure = self.measures[-1]
+        self.assertEqual(measure['operation'], 'clean')
+        self.assertEqual(measure['option_count'], 1)
+        self.assertEqual(measure['queries'], 2)
+        self.assertIsInstance(measure['exception'], ValidationError)
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class TypeaheadTest(TestCase):
+
+    URL = '/books/search/'
+
+    def search(self, **params):
+        response = Client().get(self.URL, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_html_output(self):
+        form = TypeaheadBookSelectionForm({'author': '1', 'book': '2'})
+        html = str(form['book'])
+        self.assertIn('data-related-search="/books/search/"', html)
+        self.assertIn('data-related-parent="id_author"', html)
+        self.assertIn('data-related-select="id_book"', html)
+        self.assertIn('<option value="2" selected="selected" class="sub_1">'
+            'La Curee</option>', html)
+        self.assertNotIn('La Fortune des Rougon', html)
+        self.assertIn('related_typeahead.js', str(form.media))
+        self.assertNotIn('related_select.js', str(form.media))
+
+    def test_search(self):
+        page = self.search(parent='1', q='le')
+        self.assertEqual(page['results'], [['3', 'Le Ventre de Paris']])
+        self.assertEqual(page['next'], None)
+
+    def test_keyset_pagination(self):
+        page = self.search(parent='1')
+        self.assertEqual(page['results'], [
+            ['2', 'La Curee'], ['1', 'La Fortune des Rougon']])
+        self.assertEqual(page['next'], ['La Fortune des Rougon', '1'])
+        page = self.search(parent='1', after=json.dumps(page['next']))
+        self.assertEqual(page['results'], [['3', 'Le Ventre de Paris']])
+        self.assertEqual(page['next'], None)
+
+    def test_bad_requests(self):
+        client = Client()
+        self.assertEqual(client.get(self.URL, {'q': 'la'}).status_code, 400)
+        self.assertEqual(client.get(self.URL,
+            {'parent': '1', 'after': 'nope'}).status_code, 400)
+
+    def test_clean(self):
+        form = TypeaheadBookSelectionForm({'author': '2', 'book': '1'})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['book'],
+            ['Value does not match author value.'])
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class GroupedOptionsTest(TestCase):
+
+    def test_html_output(self):
+        html = str(GroupedBookSelectionForm()['book'])
+        self.assertIn('\n'.join([
+            '<option value="" class="static">---------</option>',
+            '<optgroup label="Emile Zola" class="sub_1">',
+            '<option value="1" class="sub_1">La Fortune des Rougon</option>',
+            '<option value="2" class="sub_1">La Curee</option>',
+            '<option value="3" class="sub_1">Le Ventre de Paris</option>',
+            '</optgroup>',
+            '<optgroup label="Marie-Henri Beyle (Stendhal)" class="sub_2">',
+            '<option value="4" class="sub_2">Le Rouge et le Noir</option>',
+            '<option value="5" class="sub_2">La Chartreuse de Parme</option>',
+            '</optgroup>',
+        ]), html)
+
+    def test_single_query(self):
+        form = GroupedBookSelectionForm()
+        with self.assertNumQueries(1):
+            str(form['book'])
+
+    def test_omit_parents(self):
+        form = GroupedBookSelectionForm()
+        form.fields['book'].widget.omit_parents = [2]
+        html = str(form['book'])
+        self.assertIn('class="sub_1"', html)
+        self.assertNotIn('class="sub_2"', html)
+
+    def test_selected_group_is_kept(self):
+        form = GroupedBookSelectionForm({'author': '2', 'book': '4'})
+        form.fields['book'].widget.omit_parents = [2]
+        html = str(form['book'])
+        self.assertIn('<option value="4" selected="selected" class="sub_2">',
+            html)
+
+    def test_stream_matches_render(self):
+        form = GroupedBookSelectionForm({'author': '1', 'book': '2'})
+        self.assertEqual(''.join(stream_bound_field(form['book'], 2)),
+            str(form['book']))
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class JsonChoicesTest(TestCase):
+
+    def get_choices(self, html):
+        match = re.search(r'<script type="application/json" '
+            r'id="id_book_choices">(.*)</script>', html)
+        return json.loads(match.group(1))
+
+    def test_html_output(self):
+        html = str(JsonBookSelectionForm({'author': '1', 'book': '2'})['book'])
+        self.assertIn('data-related-choices="id_book_choices"', html)
+        self.assertEqual(re.findall(r'<option value="(\d*)"', html),
+            ['', '2'])
+        self.assertEqual(self.get_choices(html), {
+            '1': [[1, 'La Fortune des Rougon'], [2, 'La Curee'],
+                [3, 'Le Ventre de Paris']],
+            '2': [[4, 'Le Rouge et le Noir'], [5, 'La Chartreuse de Parme']],
+        })
+
+    def test_script_escaping(self):
+        Book.objects.filter(pk=1).update(name='</script><b>')
+        html = str(JsonBookSelectionForm()['book'])
+        self.assertNotIn('</script><b>', html)
+        self.assertEqual(self.get_choices(html)['1'][0], [1, '</script><b>'])
+
+    def test_html_fallback_per_form(self):
+        form = JsonBookSelectionForm()
+        form.fields['book'].widget.json_choices = False
+        html = str(form['book'])
+        self.assertNotIn('application/json', html)
+        self.assertEqual(re.findall(r'<option value="(\d*)"', html),
+            ['', '1', '2', '3', '4', '5'])
+        # The other forms keep the JSON choices
+        self.assertIn('application/json', str(JsonBookSelectionForm()['book']))
+
+    def test_stream_matches_render(self):
+        form = JsonBookSelectionForm({'author': '1', 'book': '2'})
+        self.assertEqual(''.join(stream_bound_field(form['book'], 2)),
+            str(form['book']))
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class PairedFieldsTest(TestCase):
+
+    def test_single_query_rendering(self):
+        Author.objects.create(name='Nobody', title='MR')
+        form = PairedBookSelectionForm()
+        with self.assertNumQueries(1):
+            author = str(form['author'])
+            book = str(form['book'])
+        self.assertEqual(re.findall(r'<option value="(\d*)"', author),
+            ['', '1', '2'])
+        self.assertNotIn('Nobody', author)
+        self.assertIn('<option value="5" class="sub_2">'
+            'La Chartreuse de Parme</option>', book)
+
+    def test_single_query_validation(self):
+        form = PairedBookSelectionForm({'author': '2', 'book': '4'})
+        with self.assertNumQueries(1):
+            self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['author'].name,
+            'Marie-Henri Beyle (Stendhal)')
+        self.assertEqual(form.cleaned_data['book'].pk, 4)
+
+    def test_non_consistent_choices(self):
+        form = PairedBookSelectionForm({'author': '1', 'book': '4'})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['book'],
+            ['Value does not match author value.'])
+
+
+class FormConstructionTest(TestCase):
+
+    def test_queryset_cloned_on_use(self):
+        base_field = BookSelectionForm.base_fields['book']
+        field = BookSelectionForm().fields['book']
+        other_field = BookSelectionForm().fields['book']
+        queryset = field.queryset
+        self.assertIs(field.queryset, queryset)
+        self.assertIsNot(queryset, base_field.queryset)
+        self.assertIsNot(queryset, other_field.queryset)
+        self.assertIs(field.widget.choices.queryset, queryset)
+
+    def test_widget_copy(self):
+        form = BookSelectionForm()
+        other_form = BookSelectionForm()
+        widget = form.fields['book'].widget
+        widget.attrs['class'] = 'wide'
+        other_widget = other_form.fields['book'].widget
+        self.assertEqual(other_widget.attrs, {})
+        self.assertEqual(other_widget.related_form_field_name, 'author')
+        self.assertIs(other_widget.choices.field, other_form.fields['book'])
+
+
+@pytest.mark.skipif(not TEMPLATE_WIDGETS, reason="requires Django >= 1.11")
+@pytest.mark.usefixtures("load_db_fixtures")
+class TemplateRenderingTest(TestCase):
+
+    OPTION = re.compile(r'<option value="([^"]*)"([^>]*)>')
+
+    def parse_options(self, html):
+        return [(value, re.search(r'class="([^"]*)"', attrs).group(1),
+                'selected' in attrs)
+            for value, attrs in self.OPTION.findall(html)]
+
+    def test_optgroups(self):
+        form = BookSelectionForm({'author': '1', 'book': '2'})
+        widget = form.fields['book'].widget
+        context = widget.get_context('book', form['book'].value(), {})
+        self.assertEqual(context['widget']['attrs']['data-related-parent'],
+            'id_author')
+        options = [option for group_name, group, index
+            in context['widget']['optgroups'] for option in group]
+        self.assertEqual([(o['value'], o['attrs']['class'], o['selected'])
+            for o in options], [
+            ('', 'static', False),
+            ('1', 'sub_1', False),
+            ('2', 'sub_1', True),
+            ('3', 'sub_1', False),
+            ('4', 'sub_2', False),
+            ('5', 'sub_2', False),
+        ])
+
+    def test_template_matches_fast_path(self):
+        from django import forms
+        form = MultiBookSelectionForm(MultiValueDict({
+            'author': ['1'], 'book': ['1', '3']}))
+        widget = form.fields['book'].widget
+        value = form['book'].value()
+        options = self.parse_options(widget.render('book', value))
+        self.assertEqual(len(options), 6)
+        self.assertEqual([o[0] for o in options if o[2]], ['1', '3'])
+        self.assertEqual(options, self.parse_options(
+            forms.Select.render(widget, 'book', value)))
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class ChoicesMapTest(TestCase):
+
+    URL = '/books/map/'
+
+    def setUp(self):
+        cache.clear()
+
+    def test_choices_map(self):
+        response = Client().get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), {
+            '1': [['1', 'La Fortune des Rougon'], ['2', 'La Curee'],
+                ['3', 'Le Ventre de Paris']],
+            '2': [['4', 'Le Rouge et le Noir'],
+                ['5', 'La Chartreuse de Parme']],
+        })
+        self.assertTrue(response['ETag'].startswith('"'))
+
+    def test_not_modified(self):
+        client = Client()
+        etag = client.get(self.URL)['ETag']
+        response = client.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def test_etag_changes_on_save(self):
+        client = Client()
+        etag = client.get(self.URL)['ETag']
+        book = Book.objects.get(pk=1)
+        book.name = 'La Fortune'
+        book.save()
+        response = client.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@pytest.mark.skipif(ChoiceLoader is None,
+    reason="requires Python 3 and Django >= 4.1")
+@pytest.mark.usefixtures("load_db_fixtures")
+class ChoiceLoaderTest(TransactionTestCase):
+
+    def test_coalesced_lookups(self):
+        import asyncio
+        loader = ChoiceLoader(BookSelectionForm.base_fields['book'])
+        batches = []
+        fetch = loader.fetch
+
+        def counting_fetch(parents):
+            batches.append(sorted(parents))
+            return fetch(parents)
+        loader.fetch = counting_fetch
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            results = loop.run_until_complete(asyncio.gather(
+                loader.load(1), loader.load(2), loader.load(1),
+                loader.load(3)))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        self.assertEqual(batches, [[1, 2, 3]])
+        self.assertEqual(results[0], [['1', 'La Fortune des Rougon'],
+            ['2', 'La Curee'], ['3', 'Le Ventre de Paris']])
+        self.assertEqual(results[0], results[2])
+        self.assertEqual(results[1], [['4', 'Le Rouge et le Noir'],
+            ['5', 'La Chartreuse de Parme']])
+        self.assertEqual(results[3], [])
+
+
+@pytest.mark.skipif(BookSelectionSerializer is None,
+    reason="requires djangorestframework")
+@pytest.mark.usefixtures("load_db_fixtures")
+class SerializerTest(TestCase):
+
+    def test_single_item(self):
+        serializer = BookSelectionSerializer(data={'author': 1, 'book': 2})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(serializer.validated_data['book'],
+            Book.objects.get(pk=2))
+        self.assertEqual(serializer.data, {'author': 1, 'book': 2})
+
+        serializer = BookSelectionSerializer(data={'author': 1, 'book': 4})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['book'],
+            ['Value does not match author value.'])
+
+    def test_malformed_value(self):
+        for data in ({'book': 'x'}, {'author': 1, 'book': 'x'}):
+            serializer = BookSelectionSerializer(data=data)
+            self.assertFalse(serializer.is_valid())
+            self.assertEqual(serializer.errors['book'][0].code,
+                'incorrect_type')
+        serializer = BookSelectionSerializer(data=[{'book': 'x'},
+            {'author': 1, 'book': 'x'}], many=True)
+        self.assertFalse(serializer.is_valid())
+        errors = serializer.errors
+        if not isinstance(errors, list):
+            errors = [errors[0], errors[1]]
+        self.assertEqual([item['book'][0].code for item in errors],
+            ['incorrect_type', 'incorrect_type'])
+
+    def test_list_validated_at_once(self):
+        data = [
+            {'author': 1, 'book': 1},
+            {'author': 1, 'book': 4},
+            {'author': 2, 'book': 5},
+            {'author': 2, 'book': 99},
+            {'author': 2, 'book': 'x'},
+            {'author': 2},
+        ]
+        serializer = BookSelectionSerializer(data=data, many=True)
+        # One query for all the books, the authors being looked up by
+        # their own field
+        with self.assertNumQueries(1 + len(data)):
+            self.assertFalse(serializer.is_valid())
+        errors = serializer.errors
+        if not isinstance(errors, list):
+            # LIST_SERIALIZER_ERRORS_AS_DICT, the default of recent releases
+            errors = [errors.get(i, {}) for i in range(len(data))]
+        self.assertEqual(errors[0], {})
+        self.assertEqual(errors[1],
+            {'book': ['Value does not match author value.']})
+        self.assertEqual(errors[2], {})
+        self.assertEqual(list(errors[3]), ['book'])
+        self.assertEqual(list(errors[4]), ['book'])
+        self.assertEqual(errors[5], {'book': ['This field is required.']})
+
+        serializer = BookSelectionSerializer(data=[data[0], data[2]],
+            many=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual([item['book'].pk
+            for item in serializer.validated_data], [1, 5])
+
+
+@pytest.mark.usefixtures("load_db_fixtures")
+class BulkValidationTest(TestCase):
+
+    PAIRS = [
+        ('1', '1'),
+        ('1', '4'),
+        ('2', '5'),
+        ('2', '99'),
+        ('2', 'x'),
+        ('2', ''),
+        ('x', '2'),
+    ]
+
+    def errors(self, results):
+        return [(index, error and error.messages)
+            for index, pair, error in results]
+
+    def test_validate_pairs(self):
+        field = BookSelectionForm.base_fields['book']
+        # One query per chunk, but for the chunk without any valid key
+        with self.assertNumQueries(3):
+            results = list(validate_pairs(field, iter(self.PAIRS),
+                chunk_size=2))
+        self.assertEqual([pair for index, pair, error in results],
+            self.PAIRS)
+        invalid = [field.error_messages['invalid_choice']]
+        self.assertEqual(self.errors(results), [
+            (0, None),
+            (1, ['Value does not match author value.']),
+            (2, None),
+            (3, invalid),
+            (4, invalid),
+            (5, [field.error_messages['required']]),
+            (6, ['Value does not match author value.']),
+        ])
+
+    def test_command(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as rows:
+            rows.write('author,book\n1,1\n1,4\n2,5\n2\n')
+        output = StringIO()
+        try:
+            with self.assertRaises(CommandError):
+                call_command('validate_related_pairs',
+                    'demo.polls.views.BookSelectionForm', 'book', path,
+                    skip_header=True, chunk_size=2, stdout=output)
+        finally:
+            os.remove(path)
+        lines = output.getvalue().splitlines()
+        self.assertEqual([line.split(',')[:3] for line in lines],
+            [['1', '1', '4'], ['3', '2', '']])
+
+
+@pytest.mark.skipif(django.VERSION < (1, 8),
+    reason="the threads need an in-memory database shared across "
+        "connections")
+@pytest.mark.usefixtures("load_db_fixtures")
+class ThreadedBulkValidationTest(TransactionTestCase):
+
+    def test_workers(self):
+        field = BookSelectionForm.base_fields['book']
+        pairs = BulkValidationTest.PAIRS * 3
+        self.assertEqual(
+            list(validate_pairs(field, pairs, chunk_size=2, workers=2)),
+            list(validate_pairs(field, pairs, chunk_size=2)))
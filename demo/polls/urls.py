@@ -1,11 +1,17 @@
-try:
-	from django.conf.urls import patterns, include, url
-except ImportError:
-	from django.conf.urls.defaults import patterns, include, url
+from .views import MyFormView, MySecondFormView, MyLazyFormView
+from .views import BookSelectionForm, LazyBookSelectionForm
+from .views import TypeaheadBookSelectionForm
+from related_choice_field.views import related_choices_url
+from related_choice_field.views import related_search_url
+from related_choice_field.views import related_choices_map_url
+from related_choice_field.compat import url
 
-from .views import MyFormView, MySecondFormView
-
-urlpatterns = patterns('',
+urlpatterns = [
     url(r'^$', MyFormView.as_view()),
     url(r'^2/$', MySecondFormView.as_view()),
-)
+    url(r'^lazy/$', MyLazyFormView.as_view()),
+    related_choices_url(r'^books/$', LazyBookSelectionForm, 'book'),
+    related_search_url(r'^books/search/$', TypeaheadBookSelectionForm,
+        'book', page_size=2),
+    related_choices_map_url(r'^books/map/$', BookSelectionForm, 'book'),
+]
@@ -2,9 +2,12 @@
 from django import forms
 from django.views.generic import FormView
 
-from .models import Book, Author
+from .models import Book, Author, Article, Country, Region, City
 from related_choice_field.fields import RelatedModelChoiceField
 from related_choice_field.fields import RelatedModelMultipleChoiceField
+from related_choice_field.fields import RelatedTypeahead
+from related_choice_field.fields import RelatedParentChoiceField
+from related_choice_field.forms import RelatedChoiceFormMixin
 
 
 class BookSelectionForm(forms.Form):
@@ -23,6 +26,102 @@ class MultiBookSelectionForm(forms.Form):
         related_model_name='author')
 
 
+class LazyBookSelectionForm(forms.Form):
+    author = forms.ModelChoiceField(queryset=Author.objects.all())
+    book = RelatedModelChoiceField(
+        queryset=Book.objects.all(),
+        related_form_field_name='author',
+        related_model_name='author',
+        lazy_url='/books/')
+
+
+class FilteredBookSelectionForm(RelatedChoiceFormMixin, forms.Form):
+    author = forms.ModelChoiceField(queryset=Author.objects.all())
+    book = RelatedModelChoiceField(
+        queryset=Book.objects.all(),
+        related_form_field_name='author',
+        related_model_name='author',
+        filter_on_parent=True)
+
+
+class CachedBookSelectionForm(forms.Form):
+    author = forms.ModelChoiceField(queryset=Author.objects.all())
+    book = RelatedModelChoiceField(
+        queryset=Book.objects.all(),
+        related_form_field_name='author',
+        related_model_name='author',
+        cache_options=True)
+
+
+class CachedArticleSelectionForm(forms.Form):
+    author = forms.ModelChoiceField(queryset=Author.objects.all(),
+        required=False)
+    article = RelatedModelChoiceField(
+        queryset=Article.objects.all(),
+        related_form_field_name='author',
+        related_model_name='author',
+        cache_options=True)
+
+
+class ValuesBookSelectionForm(forms.Form):
+    author = forms.ModelChoiceField(queryset=Author.objects.all())
+    book = RelatedModelChoiceField(
+        queryset=Book.objects.all(),
+        related_form_field_name='author',
+        related_model_name='author',
+        label_field='name')
+
+
+class GroupedBookSelectionForm(forms.Form):
+    author = forms.ModelChoiceField(queryset=Author.objects.all())
+    book = RelatedModelChoiceField(
+        queryset=Book.objects.all(),
+        related_form_field_name='author',
+        related_model_name='author',
+        group_by_parent=True)
+
+
+class JsonBookSelectionForm(forms.Form):
+    author = forms.ModelChoiceField(queryset=Author.objects.all())
+    book = RelatedModelChoiceField(
+        queryset=Book.objects.all(),
+        related_form_field_name='author',
+        related_model_name='author',
+        json_choices=True)
+
+
+class PairedBookSelectionForm(RelatedChoiceFormMixin, forms.Form):
+    author = RelatedParentChoiceField(
+        queryset=Author.objects.all(),
+        hide_empty_parents=True)
+    book = RelatedModelChoiceField(
+        queryset=Book.objects.all(),
+        related_form_field_name='author',
+        related_model_name='author')
+
+
+class TypeaheadBookSelectionForm(forms.Form):
+    author = forms.ModelChoiceField(queryset=Author.objects.all())
+    book = RelatedModelChoiceField(
+        queryset=Book.objects.all(),
+        related_form_field_name='author',
+        related_model_name='author',
+        label_field='name',
+        widget=RelatedTypeahead('/books/search/'))
+
+
+class CitySelectionForm(RelatedChoiceFormMixin, forms.Form):
+    country = forms.ModelChoiceField(queryset=Country.objects.all())
+    region = RelatedModelChoiceField(
+        queryset=Region.objects.all(),
+        related_form_field_name='country',
+        related_model_name='country')
+    city = RelatedModelChoiceField(
+        queryset=City.objects.all(),
+        related_form_field_name='region',
+        related_model_name='region')
+
+
 class MyFormView(FormView):
     template_name = "example.html"
     form_class = BookSelectionForm
@@ -33,3 +132,9 @@ class MySecondFormView(FormView):
     template_name = "example.html"
     form_class = MultiBookSelectionForm
     success_url = '/2/'
+
+
+class MyLazyFormView(FormView):
+    template_name = "example.html"
+    form_class = LazyBookSelectionForm
+    success_url = '/lazy/'
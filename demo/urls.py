@@ -1,12 +1,21 @@
-from django.conf.urls.defaults import patterns, include, url
-
-from polls.views import MyFormView, MySecondFormView
+from polls.views import MyFormView, MySecondFormView, MyLazyFormView
+from polls.views import BookSelectionForm, LazyBookSelectionForm
+from polls.views import TypeaheadBookSelectionForm
+from related_choice_field.views import related_choices_url
+from related_choice_field.views import related_search_url
+from related_choice_field.views import related_choices_map_url
+from related_choice_field.compat import url
 
 from django.contrib import admin
 admin.autodiscover()
 
-urlpatterns = patterns('',
+urlpatterns = [
     url(r'^$', MyFormView.as_view()),
     url(r'^2/$', MySecondFormView.as_view()),
-    url(r'^admin/', include(admin.site.urls)),
-)
+    url(r'^lazy/$', MyLazyFormView.as_view()),
+    related_choices_url(r'^books/$', LazyBookSelectionForm, 'book'),
+    related_search_url(r'^books/search/$', TypeaheadBookSelectionForm,
+        'book', page_size=2),
+    related_choices_map_url(r'^books/map/$', BookSelectionForm, 'book'),
+    url(r'^admin/', admin.site.urls),
+]
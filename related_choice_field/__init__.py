@@ -7,6 +7,11 @@ A ModelChoiceField that can span a relation between two models.
 :copyright: (c) 2012 by the Linovia, see AUTHORS for more details.
 :license: BSD, see LICENSE for more details.
 """
+import django
+
+if django.VERSION < (3, 2):
+    # Found by itself by later versions, ignored before 1.7
+    default_app_config = 'related_choice_field.apps.RelatedChoiceFieldConfig'
 
 try:
     VERSION = __import__('pkg_resources') \
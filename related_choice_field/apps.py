@@ -0,0 +1,15 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.apps import AppConfig, apps
+
+from .cache import connect_invalidation, get_invalidated_models
+
+
+class RelatedChoiceFieldConfig(AppConfig):
+    name = 'related_choice_field'
+
+    def ready(self):
+        # The cached options are dropped by every process saving children,
+        # even the ones never importing the forms or the URLconf
+        for label, related_model_name in get_invalidated_models():
+            connect_invalidation(apps.get_model(label), related_model_name)
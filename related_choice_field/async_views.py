@@ -0,0 +1,115 @@
+"""
+Asynchronous counterpart of related_choice_field.views.
+
+Requires Python 3 and Django >= 4.1 for the asynchronous ORM, which is why
+it lives in its own module.
+"""
+import asyncio
+import json
+import weakref
+
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.urls import re_path
+from django.utils.encoding import force_str
+from django.views.generic import View
+
+from .fields import chunked
+
+
+class ChoiceLoader(object):
+    """
+    Coalesces the lookups of the children of several parents made within
+    ``delay`` seconds into one ``<related_model_name>_id__in`` query and
+    splits the result back per parent.
+
+    Lookups are batched per event loop, so requests only coalesce when
+    they share one, as under ASGI.
+    """
+
+    def __init__(self, field, delay=0.002):
+        self.field = field
+        self.delay = delay
+        # Pending futures by parent and dispatching task, per event loop
+        self.batches = weakref.WeakKeyDictionary()
+
+    async def load(self, parent):
+        """
+        Returns the ``(value, label)`` choices of the given parent, which
+        must already be converted to the foreign key python type.
+        """
+        loop = asyncio.get_running_loop()
+        batch = self.batches.get(loop)
+        if batch is None:
+            pending = {}
+            batch = self.batches[loop] = (
+                pending, loop.create_task(self.dispatch(pending)))
+        pending = batch[0]
+        future = pending.get(parent)
+        if future is None:
+            future = pending[parent] = loop.create_future()
+        return await future
+
+    async def dispatch(self, pending):
+        await asyncio.sleep(self.delay)
+        del self.batches[asyncio.get_running_loop()]
+        try:
+            choices = await self.fetch(list(pending))
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for parent, future in pending.items():
+            if not future.done():
+                future.set_result(choices.get(parent, []))
+
+    async def fetch(self, parents):
+        """
+        Returns a dict of the choices of every parent.
+        """
+        iterator = self.field.choices
+        lookup = '%s_id__in' % self.field.related_model_name
+        choices = dict((parent, []) for parent in parents)
+        for chunk in chunked(parents, self.field.chunk_size):
+            async for obj in iterator.queryset.filter(**{lookup: chunk}):
+                (value, related_value), label = iterator.choice(obj)
+                choices[related_value].append(
+                    [force_str(value), force_str(label)])
+        return choices
+
+
+class AsyncRelatedChoicesView(View):
+    """
+    Asynchronous version of RelatedChoicesView.
+
+    Concurrent requests share the ``loader`` of the field so that a page
+    with many cascading selects costs one query per batch of parents
+    rather than one query per select.
+    """
+    loader = None
+    parent_parameter = 'parent'
+
+    async def get(self, request, *args, **kwargs):
+        parent = request.GET.get(self.parent_parameter)
+        if not parent:
+            return HttpResponseBadRequest()
+        try:
+            parent = self.loader.field.get_related_key_field().to_python(
+                parent)
+        except ValidationError:
+            return HttpResponseBadRequest()
+        choices = await self.loader.load(parent)
+        return HttpResponse(json.dumps(choices),
+            content_type='application/json')
+
+
+def async_related_choices_url(regex, form_class, field_name, name=None,
+        delay=0.002):
+    """
+    Returns an url pattern serving the lazy choices of the
+    ``field_name`` field declared on ``form_class`` asynchronously.
+    """
+    loader = ChoiceLoader(form_class.base_fields[field_name], delay)
+    return re_path(regex, AsyncRelatedChoicesView.as_view(loader=loader),
+        name=name)
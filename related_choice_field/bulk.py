@@ -0,0 +1,155 @@
+"""
+Validation of large streams of (parent, child) pairs, such as imports,
+with the rules of RelatedModelChoiceField.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import threading
+from collections import deque
+from itertools import islice
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from django.core.exceptions import ValidationError
+from django.core.validators import EMPTY_VALUES
+from django.db import connection
+
+
+def iterate_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class PairsChunk(object):
+    """
+    A chunk of pairs, their coerced keys and the parents of the children
+    found in the database once fetched.
+    """
+
+    def __init__(self, start, pairs, field):
+        self.start = start
+        self.pairs = pairs
+        self.field = field
+        self.keys = []
+        self.found = None
+        self.error = None
+        self.done = threading.Event()
+        key_field = field.get_key_field()
+        related_key_field = field.get_related_key_field()
+        for parent, child in pairs:
+            if child in EMPTY_VALUES:
+                self.keys.append(None)
+                continue
+            try:
+                key = key_field.to_python(child)
+            except ValidationError:
+                key = None
+            try:
+                parent = related_key_field.to_python(parent)
+            except ValidationError:
+                parent = None
+            self.keys.append((key, parent))
+
+    def fetch(self):
+        """
+        Fetches the parents of the children of the chunk with one query.
+        """
+        try:
+            keys = set(key[0] for key in self.keys if key is not None)
+            keys.discard(None)
+            key = self.field.to_field_name or 'pk'
+            self.found = dict(self.field.queryset.order_by()
+                .filter(**{'%s__in' % key: list(keys)})
+                .values_list(key, '%s_id' % self.field.related_model_name))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def results(self):
+        """
+        Yields the ``(index, pair, error)`` of every pair, the error being
+        None for the valid ones.
+        """
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        field = self.field
+        for i, (pair, key) in enumerate(zip(self.pairs, self.keys)):
+            error = None
+            if key is None:
+                if field.required:
+                    error = ValidationError(field.error_messages['required'],
+                        code='required')
+            elif key[0] is None or key[0] not in self.found:
+                error = ValidationError(
+                    field.error_messages['invalid_choice'],
+                    code='invalid_choice')
+            elif key[1] is None or self.found[key[0]] != key[1]:
+                error = field.mismatch_error()
+            yield self.start + i, pair, error
+
+
+def fetch_chunks(chunks):
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            break
+        chunk.fetch()
+    # The thread is done with its connection
+    connection.close()
+
+
+def validate_pairs(field, pairs, chunk_size=None, workers=0):
+    """
+    Yields ``(index, (parent, child), error)`` for each of the ``pairs``
+    submitted to the RelatedModelChoiceField ``field``, ``error`` being
+    None or the ValidationError the field would raise.
+
+    The pairs are read and checked by chunks of ``chunk_size``, each one
+    costing a single query. With ``workers`` threads, the queries of the
+    next chunks run while the current ones are read and checked, with at
+    most ``workers + 1`` chunks in memory.
+    """
+    chunk_size = chunk_size or field.chunk_size
+    if not workers:
+        start = 0
+        for pairs_chunk in iterate_chunks(pairs, chunk_size):
+            chunk = PairsChunk(start, pairs_chunk, field)
+            chunk.fetch()
+            for result in chunk.results():
+                yield result
+            start += len(pairs_chunk)
+        return
+
+    chunks = Queue()
+    threads = [threading.Thread(target=fetch_chunks, args=(chunks,))
+        for i in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    pending = deque()
+    try:
+        start = 0
+        for pairs_chunk in iterate_chunks(pairs, chunk_size):
+            chunk = PairsChunk(start, pairs_chunk, field)
+            chunks.put(chunk)
+            pending.append(chunk)
+            start += len(pairs_chunk)
+            while len(pending) > workers:
+                for result in pending.popleft().results():
+                    yield result
+        while pending:
+            for result in pending.popleft().results():
+                yield result
+    finally:
+        for thread in threads:
+            chunks.put(None)
+        for thread in threads:
+            thread.join()
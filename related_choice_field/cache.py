@@ -0,0 +1,191 @@
+"""
+Versioned caching of the rendered options and of the choices ETags.
+
+The versions are random values kept in the default cache and dropped by
+the save and delete signals of the children, in the process running them.
+The cache must therefore be shared by all the processes serving the site,
+which LocMemCache is not.
+
+The signals are connected by the fields and views using the cache, or at
+startup for the RELATED_CHOICE_FIELD_INVALIDATED_MODELS setting, see
+apps.py.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.utils.translation import get_language
+
+from .compat import force_text
+from .instrumentation import record_cache_hits
+
+
+DEFAULT_TIMEOUT = 60 * 60
+DEFAULT_PREFIX = 'related_choice_field'
+
+
+def get_timeout():
+    return getattr(settings, 'RELATED_CHOICE_FIELD_CACHE_TIMEOUT',
+        DEFAULT_TIMEOUT)
+
+
+def get_prefix():
+    return getattr(settings, 'RELATED_CHOICE_FIELD_CACHE_PREFIX',
+        DEFAULT_PREFIX)
+
+
+def _hash(*parts):
+    return hashlib.md5(':'.join(force_text(p) for p in parts)
+        .encode('utf-8')).hexdigest()
+
+
+def _model_label(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.object_name)
+
+
+def version_key(model, related_model_name, parent):
+    return '%s:version:%s' % (get_prefix(),
+        _hash(_model_label(model), related_model_name, parent))
+
+
+def fragment_key(model, related_model_name, query, parent, version,
+        variant=''):
+    return '%s:options:%s' % (get_prefix(),
+        _hash(_model_label(model), related_model_name, query,
+            get_language(), parent, version, variant))
+
+
+def table_version_key(model, related_model_name):
+    return '%s:table_version:%s' % (get_prefix(),
+        _hash(_model_label(model), related_model_name))
+
+
+def invalidate(model, related_model_name, parent):
+    """
+    Drops the cached options of the children of ``parent``.
+    """
+    cache.delete_many([version_key(model, related_model_name, parent),
+        table_version_key(model, related_model_name)])
+
+
+def _add_version(key):
+    version = uuid.uuid4().hex
+    if not cache.add(key, version, get_timeout()):
+        # Someone else created it meanwhile
+        version = cache.get(key, version)
+    return version
+
+
+def get_versions(model, related_model_name, parents):
+    """
+    Returns the current version of every parent, creating the missing ones.
+    """
+    keys = dict((version_key(model, related_model_name, parent), parent)
+        for parent in parents)
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, parent in keys.items():
+        if key not in found:
+            found[key] = _add_version(key)
+        versions[parent] = found[key]
+    return versions
+
+
+def get_table_version(model, related_model_name):
+    """
+    Returns the current version of all the children, which changes
+    whenever any of them is saved or deleted.
+    """
+    key = table_version_key(model, related_model_name)
+    return cache.get(key) or _add_version(key)
+
+
+def get_table_etag(queryset, related_model_name):
+    """
+    Returns a strong ETag for the children selected by ``queryset``.
+    """
+    try:
+        query = force_text(queryset.query)
+    except Exception:
+        # Empty querysets can't be turned into SQL
+        query = ''
+    version = get_table_version(queryset.model, related_model_name)
+    return '"%s"' % _hash(_model_label(queryset.model), related_model_name,
+        query, get_language(), version)
+
+
+def get_fragments(queryset, related_model_name, parents, render,
+        variant=''):
+    """
+    Returns a dict of the rendered options per parent.
+
+    The missing fragments are built with ``render(missing_parents)``
+    which must return a dict of rendered options per parent. ``variant``
+    tells apart the fields rendering the same queryset differently.
+    """
+    try:
+        query = force_text(queryset.query)
+    except Exception:
+        # Some querysets, such as empty ones, can't be turned into SQL
+        return render(parents)
+    model = queryset.model
+    versions = get_versions(model, related_model_name, parents)
+    keys = dict((fragment_key(model, related_model_name, query, parent,
+        versions[parent], variant), parent) for parent in parents)
+    found = cache.get_many(list(keys))
+    record_cache_hits(len(found))
+    fragments = dict((keys[key], value) for key, value in found.items())
+    missing = [parent for parent in parents if parent not in fragments]
+    if missing:
+        rendered = render(missing)
+        to_cache = {}
+        for key, parent in keys.items():
+            if parent in missing:
+                fragments[parent] = rendered.get(parent, '')
+                to_cache[key] = fragments[parent]
+        cache.set_many(to_cache, get_timeout())
+    return fragments
+
+
+def connect_invalidation(model, related_model_name):
+    """
+    Invalidates the cached options whenever a child is saved or deleted.
+    """
+    attname = '%s_id' % related_model_name
+    old_attname = '_related_choice_field_old_%s' % attname
+
+    def store_old_parent(sender, instance, raw=False, **kwargs):
+        if instance.pk is None or raw:
+            return
+        old = sender._default_manager.filter(pk=instance.pk) \
+            .values_list(attname, flat=True)
+        setattr(instance, old_attname, old[0] if old else None)
+
+    def invalidate_on_save(sender, instance, **kwargs):
+        invalidate(sender, related_model_name, getattr(instance, attname))
+        old = getattr(instance, old_attname, None)
+        if old is not None and old != getattr(instance, attname):
+            invalidate(sender, related_model_name, old)
+
+    def invalidate_on_delete(sender, instance, **kwargs):
+        invalidate(sender, related_model_name, getattr(instance, attname))
+
+    uid = 'related_choice_field:%s:%s' % (_model_label(model), attname)
+    pre_save.connect(store_old_parent, sender=model, weak=False,
+        dispatch_uid=uid)
+    post_save.connect(invalidate_on_save, sender=model, weak=False,
+        dispatch_uid=uid)
+    post_delete.connect(invalidate_on_delete, sender=model, weak=False,
+        dispatch_uid=uid)
+
+
+def get_invalidated_models():
+    """
+    Returns the ``(model label, related_model_name)`` pairs of the
+    RELATED_CHOICE_FIELD_INVALIDATED_MODELS setting.
+    """
+    return getattr(settings, 'RELATED_CHOICE_FIELD_INVALIDATED_MODELS', ())
@@ -0,0 +1,62 @@
+"""
+Compatibility between the supported Django versions, from 1.3 on.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import django
+
+try:
+    from django.utils.encoding import force_text
+except ImportError:
+    try:
+        from django.utils.encoding import force_unicode as force_text
+    except ImportError:
+        # Django >= 4.0, Python 3 only
+        from django.utils.encoding import force_str as force_text
+
+try:
+    from django.forms.utils import flatatt
+except ImportError:
+    # Django < 1.7
+    from django.forms.util import flatatt
+
+try:
+    from django.utils.translation import ugettext_lazy as gettext_lazy
+except ImportError:
+    # Django >= 4.0
+    from django.utils.translation import gettext_lazy
+
+try:
+    from django.urls import re_path as url
+except ImportError:
+    try:
+        from django.conf.urls import url
+    except ImportError:
+        from django.conf.urls.defaults import url
+
+try:
+    from django.utils.module_loading import import_string
+except ImportError:
+    # Django < 1.7
+    from django.utils.module_loading import import_by_path as import_string
+
+try:
+    from django.utils.choices import BaseChoiceIterator
+except ImportError:
+    # Django < 5.0 doesn't tell lazy choices apart
+    BaseChoiceIterator = object
+
+# Django >= 1.11 renders the widgets with templates and changed the
+# build_attrs signature
+TEMPLATE_WIDGETS = django.VERSION >= (1, 11)
+
+
+def build_attrs(widget, attrs=None, **kwargs):
+    """
+    Returns the widget attributes updated with ``attrs`` and ``kwargs``.
+    """
+    if not TEMPLATE_WIDGETS:
+        return widget.build_attrs(attrs, **kwargs)
+    final_attrs = widget.build_attrs(widget.attrs, attrs)
+    final_attrs.update(kwargs)
+    return final_attrs
@@ -1,91 +1,786 @@
 from __future__ import print_function, division, absolute_import, unicode_literals
 
+import copy
+import json
 from itertools import chain
-from django.forms.util import flatatt
 from django.utils.safestring import mark_safe
 
 from django import forms
 from django.core.exceptions import ValidationError
+from django.core.validators import EMPTY_VALUES
+from django.db.models import Q
 from django.utils.html import escape, conditional_escape
-from django.utils.datastructures import MultiValueDict, MergeDict
-from django.utils.translation import ugettext_lazy as _
+from django.forms.models import ModelChoiceIterator
 from django.forms.widgets import MultipleHiddenInput
+
+from .compat import BaseChoiceIterator, build_attrs, flatatt, force_text
+from .compat import gettext_lazy as _
+from .cache import get_fragments, connect_invalidation
+from .instrumentation import instrumented
+
+# SQLite doesn't accept more than 999 parameters per query
+CHUNK_SIZE = 500
+
+OPTION_HTML = '<option value="%s"%s class="%s">%s</option>'
+
 try:
-    from django.utils.encoding import force_text
-except:
-    from django.utils.encoding import force_unicode as force_text
+    INTEGER_TYPES = (int, long)
+except NameError:
+    INTEGER_TYPES = (int,)
 
 
-MEDIA_JS = """
-    <script type="text/javascript" defer="defer">
-        function cascadeSelect(parent, child){
-                var childOptions = child.find('option:not(.static)');
-                    child.data('options',childOptions);
+def json_for_script(value):
+    """
+    Returns ``value`` as compact JSON safe to embed in a <script> element.
+    """
+    return json.dumps(value, separators=(',', ':')).replace('<', '\\u003c') \
+        .replace('>', '\\u003e').replace('&', '\\u0026')
 
-                parent.change(function(){
-                    childOptions.remove();
-                    child.append(
-                        child.data('options').filter('.sub_' + this.value)
-                    ).change();
-                })
 
-                childOptions.not('.static, .sub_' + parent.val()).remove();
-        }
+def _class_path(klass):
+    return '%s.%s' % (klass.__module__, klass.__name__)
+
+
+def chunked(values, size):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def iterate_queryset(queryset, chunk_size):
+    try:
+        return queryset.iterator(chunk_size=chunk_size)
+    except TypeError:
+        # Django < 2.0 has no chunk_size
+        return queryset.iterator()
+
+
+def stream_bound_field(bound_field, chunk_size=CHUNK_SIZE):
+    """
+    Streams the html of a bound related field, for templates or a
+    StreamingHttpResponse.
+    """
+    widget = bound_field.field.widget
+    attrs = {}
+    if bound_field.auto_id and 'id' not in widget.attrs:
+        attrs['id'] = bound_field.auto_id
+    if hasattr(bound_field, 'build_widget_attrs'):
+        # Django >= 1.10 adds the required attribute
+        attrs = bound_field.build_widget_attrs(attrs)
+    return widget.stream(bound_field.html_name, bound_field.value(),
+        attrs=attrs, chunk_size=chunk_size)
+
+
+class SharedChoiceIterator(BaseChoiceIterator):
+    """
+    Evaluates the choices of a related field once and replays them to
+    every widget it is assigned to, see related_choice_field.forms.
+    """
+
+    def __init__(self, choices):
+        self.iterator = choices
+        self.field = choices.field
+        self.queryset = choices.queryset
+        self._choices = None
+
+    def get_choices(self):
+        if self._choices is None:
+            # list() would ask the iterator for its length, another query
+            self._choices = [choice for choice in self.iterator]
+        return self._choices
+
+    def __iter__(self):
+        return iter(self.get_choices())
+
+    def __len__(self):
+        return len(self.get_choices())
+
+    def choice(self, obj):
+        return self.iterator.choice(obj)
+
+    def for_parent(self, parent):
+        """
+        Returns the empty choice and the children of the given parent.
+        """
+        parent = force_text(parent)
+        return [(value, label) for value, label in self.get_choices()
+            if not value or force_text(value[1]) == parent]
+
+
+class PairedChoiceIterator(SharedChoiceIterator):
+    """
+    Shares the choices of a related field with its parent field, see
+    RelatedParentChoiceField: the children are read with their parent in a
+    single query, ordered like the parents, and the parents that have
+    children are collected meanwhile.
+    """
+
+    def __init__(self, choices, parent_field):
+        super(PairedChoiceIterator, self).__init__(choices)
+        self.parent_field = parent_field
+        self._parents = None
+
+    def get_choices(self):
+        if self._choices is None:
+            related_model_name = self.field.related_model_name
+            choices = []
+            if self.field.empty_label is not None:
+                choices.append(('', self.field.empty_label))
+            parents = []
+            seen = set()
+            for obj in self.get_paired_queryset():
+                choices.append(self.iterator.choice(obj))
+                parent = getattr(obj, related_model_name)
+                if parent is not None and parent.pk not in seen:
+                    seen.add(parent.pk)
+                    parents.append(parent)
+            self._choices, self._parents = choices, parents
+        return self._choices
+
+    def get_parents(self):
+        self.get_choices()
+        return self._parents
+
+    def get_paired_queryset(self):
+        related_model_name = self.field.related_model_name
+        parent_queryset = self.parent_field.queryset
+        queryset = self.queryset.select_related(related_model_name)
+        if parent_queryset.query.where:
+            queryset = queryset.filter(
+                **{'%s__in' % related_model_name: parent_queryset})
+        ordering = []
+        for name in parent_queryset.query.order_by or \
+                parent_queryset.model._meta.ordering or ['pk']:
+            if name.startswith('-'):
+                ordering.append('-%s__%s' % (related_model_name, name[1:]))
+            else:
+                ordering.append('%s__%s' % (related_model_name, name))
+        ordering.append('%s__pk' % related_model_name)
+        ordering.extend(queryset.query.order_by or
+            queryset.model._meta.ordering or ['pk'])
+        return queryset.order_by(*ordering)
+
+
+class ParentChoiceIterator(BaseChoiceIterator):
+    """
+    Iterates over the parents collected by a PairedChoiceIterator.
+    """
+
+    def __init__(self, field, children):
+        self.field = field
+        self.children = children
+        self.queryset = field.queryset
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for parent in self.children.get_parents():
+            yield self.choice(parent)
+
+    def __len__(self):
+        return len(self.children.get_parents()) + \
+            (self.field.empty_label is not None and 1 or 0)
+
+    def choice(self, obj):
+        return (self.field.prepare_value(obj),
+            self.field.label_from_instance(obj))
+
+
+class RelatedModelChoiceIterator(ModelChoiceIterator):
+    """
+    Yields the choices as ``((value, related value), label)`` pairs on
+    every Django version, Django >= 3.1 wrapping the values otherwise.
+
+    The queryset of the field is only read when the choices are, so
+    creating the iterator with a form doesn't clone it.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self._queryset = None
+
+    def _get_queryset(self):
+        if self._queryset is None:
+            return self.field.queryset
+        return self._queryset
+
+    def _set_queryset(self, queryset):
+        self._queryset = queryset
+
+    queryset = property(_get_queryset, _set_queryset)
+
+    def choice(self, obj):
+        return (self.field.prepare_value(obj),
+            self.field.label_from_instance(obj))
+
+
+class RelatedValuesChoiceIterator(BaseChoiceIterator):
+    """
+    Iterates over the choices of a related field fetching the key, the
+    parent key and the label with values_list, without building model
+    instances.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self._queryset = None
+
+    def _get_queryset(self):
+        if self._queryset is None:
+            self._queryset = self.field.queryset.values_list(
+                self.field.to_field_name or 'pk',
+                '%s_id' % self.field.related_model_name,
+                self.field.label_field)
+        return self._queryset
+
+    def _set_queryset(self, queryset):
+        self._queryset = queryset
+
+    queryset = property(_get_queryset, _set_queryset)
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for row in iterate_queryset(self.queryset, self.field.chunk_size):
+            yield self.choice(row)
 
-        $(function(){
-            %(source)sSelect = $('#id_%(source)s');
-            %(destination)sSelect = $('#id_%(destination)s');
+    def __len__(self):
+        return self.queryset.count() + \
+            (self.field.empty_label is not None and 1 or 0)
 
-            cascadeSelect(%(source)sSelect, %(destination)sSelect);
-        });
-    </script>
-"""
+    def choice(self, row):
+        return ((row[0], row[1]), row[2])
 
 
 class RelatedSelect(forms.Select):
     allow_multiple_selected = False
+    # When set, only the selected options are rendered and the others are
+    # fetched from this url (see related_choice_field.views)
+    lazy_url = None
+    # When set, only the options of the known parent value are rendered
+    filter_on_parent = False
+    # Parent value known by the form, see related_choice_field.forms
+    parent_value = None
+    # When set, the options are cached per parent, see related_choice_field.cache
+    cache_options = False
+    # When set, the options are rendered in one <optgroup> per parent
+    group_by_parent = False
+    # Parents whose group is left out in group_by_parent mode, unless
+    # one of their children is selected
+    omit_parents = ()
+    # When set, the choices are embedded as JSON by parent and only the
+    # selected options are rendered, see stream_json_choices. Clients
+    # without JavaScript need it unset on their forms' widgets
+    json_choices = False
 
-    def render(self, name, value, attrs=None, choices=()):
+    class Media:
+        js = ('related_choice_field/js/related_select.js',)
+
+    def __deepcopy__(self, memo):
+        # The configuration set by the field is shared, the choices are
+        # replaced by the copy of the field
+        obj = self.__class__.__new__(self.__class__)
+        obj.__dict__.update(self.__dict__)
+        obj.attrs = self.attrs.copy()
+        if isinstance(self.choices, list):
+            obj.choices = self.choices[:]
+        memo[id(self)] = obj
+        return obj
+
+    @instrumented('render')
+    def render(self, name, value, attrs=None, choices=(), renderer=None):
+        # Builds the html directly: rendering a template per option, as
+        # Django >= 1.11 does, is much slower for large selects
         if value is None: value = ''
-        final_attrs = self.build_attrs(attrs, name=name)
-        output = ['<select%s>' % flatatt(final_attrs)]
+        output = [self.render_select_tag(name, attrs)]
         options = self.render_options(choices, [value], name=name)
         if options:
             output.append(options)
         output.append('</select>')
-        output.append(MEDIA_JS % {
-            'source': self.related_form_field_name,
-            'destination': name
-        })
-
+        if self.uses_json_choices():
+            output.append(''.join(self.stream_json_choices(
+                self.get_json_id(name, attrs))))
         return mark_safe('\n'.join(output))
 
-    def render_options(self, choices, selected_choices, name=None):
-        # Normalize to strings.
-        output = []
-        for option_value, option_label in chain(self.choices, choices):
+    def build_select_attrs(self, name, attrs=None):
+        final_attrs = build_attrs(self, attrs, name=name)
+        final_attrs.update(self.get_data_attrs(name))
+        if self.uses_json_choices():
+            final_attrs['data-related-choices'] = self.get_json_id(
+                name, attrs)
+        return final_attrs
+
+    def uses_json_choices(self):
+        # The multiple selects don't cascade
+        return self.json_choices and not self.allow_multiple_selected
+
+    def get_json_id(self, name, attrs=None):
+        select_id = (attrs or {}).get('id') or self.attrs.get('id') or \
+            'id_%s' % name
+        return '%s_choices' % select_id
+
+    def get_data_attrs(self, name):
+        """
+        Returns the attributes wiring the select to related_select.js.
+        """
+        data_attrs = {
+            'data-related-parent': 'id_%s' % self.get_related_name(name),
+        }
+        if self.lazy_url:
+            data_attrs['data-related-url'] = self.lazy_url
+        return data_attrs
+
+    def render_select_tag(self, name, attrs=None):
+        final_attrs = self.build_select_attrs(name, attrs)
+        if self.allow_multiple_selected:
+            return '<select multiple="multiple"%s>' % flatatt(final_attrs)
+        return '<select%s>' % flatatt(final_attrs)
+
+    def get_context(self, name, value, attrs):
+        # Template based rendering, Django >= 1.11
+        context = super(RelatedSelect, self).get_context(name, value, attrs)
+        context['widget']['attrs'].update(self.get_data_attrs(name))
+        return context
+
+    def format_value(self, value):
+        # Keeps the (value, related value) pairs for optgroups
+        if self.allow_multiple_selected:
+            return list(value or [])
+        return [value]
+
+    def optgroups(self, name, value, attrs=None):
+        """
+        Returns the choices for template based rendering, Django >= 1.11,
+        with the same selection rules as render_option.
+        """
+        selected_choices = self.normalize_selected_choices(value)
+        groups = []
+        choices = enumerate(self.get_base_choices(value))
+        for index, (option_value, option_label) in choices:
             if isinstance(option_label, (list, tuple)):
-                output.append('<optgroup label="%s">' %
-                    escape(force_text(option_value)))
-                for option in option_label:
-                    output.append(
-                        self.render_option(selected_choices, *option))
-                output.append('</optgroup>')
+                group_name = option_value
+                subchoices = option_label
             else:
-                output.append(self.render_option(
-                    selected_choices, option_value, option_label))
+                group_name = None
+                subchoices = [(option_value, option_label)]
+            groups.append((group_name, [
+                self.create_related_option(name, selected_choices, choice[0],
+                    choice[1], index, subindex if group_name else None, attrs)
+                for subindex, choice in enumerate(subchoices)], index))
+        return groups
+
+    def create_related_option(self, name, selected_choices, option_value,
+            option_label, index, subindex, attrs):
+        if option_value:
+            option_value, related_option_value = option_value
+            option_value = force_text(option_value)
+            related_option_value = force_text(related_option_value)
+            css_class = 'sub_' + related_option_value
+        else:
+            option_value, related_option_value = '', 'None'
+            css_class = 'static'
+        option_tuple = (option_value, related_option_value)
+        selected = option_tuple in selected_choices
+        if selected and not self.allow_multiple_selected:
+            selected_choices.remove(option_tuple)
+        option = self.create_option(name, option_value, option_label,
+            selected, index, subindex, attrs)
+        option['attrs']['class'] = css_class
+        return option
+
+    def stream(self, name, value, attrs=None, choices=(),
+            chunk_size=CHUNK_SIZE):
+        """
+        Renders the widget as a generator of html chunks of at most
+        ``chunk_size`` options.
+
+        The model instances are fetched with QuerySet.iterator so they
+        aren't all kept in memory. Joined, the chunks are the same as the
+        output of render.
+        """
+        if self.allow_multiple_selected:
+            selected_choices = value or []
+        else:
+            selected_choices = ['' if value is None else value]
+        yield mark_safe(self.render_select_tag(name, attrs) + '\n')
+        for options in self.stream_options(choices, selected_choices,
+                chunk_size):
+            yield mark_safe(options + '\n')
+        yield mark_safe('</select>')
+        if self.uses_json_choices():
+            yield mark_safe('\n')
+            for chunk in self.stream_json_choices(
+                    self.get_json_id(name, attrs), chunk_size):
+                yield mark_safe(chunk)
+
+    def stream_json_choices(self, json_id, chunk_size=CHUNK_SIZE):
+        """
+        Yields a <script type="application/json"> element holding all the
+        choices as ``{parent: [[value, label], ...]}``, built in chunks in
+        a single pass over the children ordered by parent.
+        """
+        iterator = self.choices
+        queryset = self.order_by_parent(iterator.queryset)
+        output = ['<script type="application/json" id="%s">{' %
+            escape(json_id)]
+        parent = missing = object()
+        for i, obj in enumerate(iterate_queryset(queryset, chunk_size)):
+            (value, related_value), label = iterator.choice(obj)
+            if related_value != parent:
+                if parent is not missing:
+                    output.append('],')
+                parent = related_value
+                output.append('%s:[' % json_for_script(force_text(parent)))
+            else:
+                output.append(',')
+            if type(value) not in INTEGER_TYPES:
+                value = force_text(value)
+            output.append(json_for_script([value, force_text(label)]))
+            if i % chunk_size == chunk_size - 1:
+                yield ''.join(output)
+                output = []
+        if parent is not missing:
+            output.append(']')
+        output.append('}</script>')
+        yield ''.join(output)
+
+    def stream_options(self, choices, selected_choices, chunk_size=CHUNK_SIZE):
+        if self.uses_grouped_options():
+            output = []
+            for line in self.grouped_options(choices, selected_choices,
+                    chunk_size):
+                output.append(line)
+                if len(output) >= chunk_size:
+                    yield '\n'.join(output)
+                    output = []
+            if output:
+                yield '\n'.join(output)
+            return
+        if self.cache_options and not self.uses_json_choices():
+            options = self.render_cached_options(choices, selected_choices)
+            if options is not None:
+                if options:
+                    yield options
+                return
+        output = []
+        base_choices = self.stream_base_choices(selected_choices, chunk_size)
+        selected_choices = self.normalize_selected_choices(selected_choices)
+        for option_value, option_label in chain(base_choices, choices):
+            output.append(self.render_choice(
+                selected_choices, option_value, option_label))
+            if len(output) >= chunk_size:
+                yield '\n'.join(output)
+                output = []
+        if output:
+            yield '\n'.join(output)
+
+    def stream_base_choices(self, selected_choices, chunk_size):
+        base_choices = self.get_base_choices(selected_choices)
+        if isinstance(base_choices, SharedChoiceIterator) or \
+                not hasattr(base_choices, 'queryset'):
+            for choice in base_choices:
+                yield choice
+            return
+        if base_choices.field.empty_label is not None:
+            yield ('', base_choices.field.empty_label)
+        for obj in iterate_queryset(base_choices.queryset, chunk_size):
+            yield base_choices.choice(obj)
+
+    @instrumented('render_options')
+    def render_options(self, choices, selected_choices, name=None):
+        if self.uses_grouped_options():
+            return '\n'.join(self.grouped_options(choices, selected_choices))
+        if self.cache_options and not self.uses_json_choices():
+            options = self.render_cached_options(choices, selected_choices)
+            if options is not None:
+                return options
+        base_choices = self.get_base_choices(selected_choices)
+        return self.render_choices(chain(base_choices, choices),
+            self.normalize_selected_choices(selected_choices))
+
+    def normalize_selected_choices(self, selected_choices):
+        """
+        Returns the selected (value, related value) pairs as a set of
+        strings so each option is looked up in constant time.
+        """
+        selected = set()
+        for choice in selected_choices:
+            if isinstance(choice, (list, tuple)) and len(choice) == 2:
+                selected.add((force_text(choice[0]), force_text(choice[1])))
+        return selected
+
+    def render_choices(self, choices, selected_choices):
+        return '\n'.join(self.render_choice(selected_choices, *choice)
+            for choice in choices)
+
+    def render_choice(self, selected_choices, option_value, option_label):
+        if isinstance(option_label, (list, tuple)):
+            output = ['<optgroup label="%s">' %
+                escape(force_text(option_value))]
+            for option in option_label:
+                output.append(self.render_option(selected_choices, *option))
+            output.append('</optgroup>')
+            return '\n'.join(output)
+        return self.render_option(
+            selected_choices, option_value, option_label)
+
+    def uses_grouped_options(self):
+        return self.group_by_parent and not \
+            (self.lazy_url or self.uses_json_choices())
+
+    def grouped_options(self, choices, selected_choices,
+            chunk_size=CHUNK_SIZE):
+        """
+        Yields the html of the empty option and of one <optgroup> per
+        parent, in a single pass over the children ordered by parent.
+
+        The choices are always read from the queryset, so they aren't
+        shared between forms in this mode.
+        """
+        iterator = self.choices
+        field = iterator.field
+        queryset = self.get_grouped_queryset(iterator, selected_choices)
+        selected_choices = self.normalize_selected_choices(selected_choices)
+        if field.empty_label is not None:
+            yield self.render_option(selected_choices, '', field.empty_label)
+        parent = missing = object()
+        for obj in iterate_queryset(queryset, chunk_size):
+            option_value, option_label = iterator.choice(obj)
+            if option_value[1] != parent:
+                if parent is not missing:
+                    yield '</optgroup>'
+                parent = option_value[1]
+                yield '<optgroup label="%s" class="%s">' % (
+                    escape(self.get_group_label(obj, parent)),
+                    escape('sub_%s' % force_text(parent)))
+            yield self.render_option(
+                selected_choices, option_value, option_label)
+        if parent is not missing:
+            yield '</optgroup>'
+        for choice in choices:
+            yield self.render_choice(selected_choices, *choice)
+
+    def get_grouped_queryset(self, iterator, selected_choices):
+        field = iterator.field
+        attname = '%s_id' % field.related_model_name
+        queryset = iterator.queryset
+        if self.filter_on_parent:
+            parent = self.get_parent_value(selected_choices)
+            if parent is not None:
+                try:
+                    queryset = queryset.filter(**{attname: parent})
+                except (ValueError, ValidationError):
+                    pass
+        selected_parents = set(force_text(choice[1])
+            for choice in selected_choices
+            if isinstance(choice, (list, tuple)) and len(choice) == 2)
+        omitted = [parent for parent in self.omit_parents
+            if force_text(parent) not in selected_parents]
+        if omitted:
+            queryset = queryset.exclude(**{'%s__in' % attname: omitted})
+        queryset = self.order_by_parent(queryset)
+        if not isinstance(getattr(iterator, 'iterator', iterator),
+                RelatedValuesChoiceIterator):
+            # For the group labels
+            queryset = queryset.select_related(field.related_model_name)
+        return queryset
+
+    def order_by_parent(self, queryset):
+        """
+        Returns the queryset ordered by parent first, then by its own
+        ordering.
+        """
+        ordering = queryset.query.order_by or \
+            queryset.model._meta.ordering or ['pk']
+        return queryset.order_by(
+            '%s__pk' % self.choices.field.related_model_name, *ordering)
+
+    def get_group_label(self, obj, parent):
+        """
+        Returns the label of the group of ``obj``: its parent, or the
+        parent value when the choices are read with values_list.
+        """
+        if hasattr(obj, '_meta'):
+            return force_text(getattr(obj,
+                self.choices.field.related_model_name))
+        return force_text(parent)
+
+    def get_base_choices(self, selected_choices):
+        """
+        Returns the choices to render.
+
+        When the parent value is known, the queryset is narrowed to its
+        children. In lazy mode, the selected choices only are rendered
+        otherwise.
+        """
+        if self.uses_json_choices():
+            return self.lazy_choices(selected_choices)
+        if not (self.lazy_url or self.filter_on_parent):
+            return self.choices
+        parent = self.get_parent_value(selected_choices)
+        if parent is not None:
+            try:
+                return self.parent_choices(parent)
+            except (ValueError, ValidationError):
+                pass
+        if self.lazy_url:
+            return self.lazy_choices(selected_choices)
+        return self.choices
+
+    def get_parent_value(self, selected_choices):
+        if self.parent_value not in EMPTY_VALUES:
+            return self.parent_value
+        for choice in selected_choices:
+            if isinstance(choice, (list, tuple)) and len(choice) == 2 and \
+                    choice[1] not in EMPTY_VALUES:
+                return choice[1]
+        return None
+
+    def parent_choices(self, parent):
+        """
+        Returns a copy of the choices iterator restricted to the children
+        of the given parent.
+        """
+        if isinstance(self.choices, SharedChoiceIterator):
+            return self.choices.for_parent(parent)
+        choices = copy.copy(self.choices)
+        choices.queryset = choices.queryset.filter(
+            **{'%s_id' % choices.field.related_model_name: parent})
+        return choices
+
+    def get_cached_parents(self, selected_choices):
+        """
+        Returns the parents whose options should be rendered from the
+        cache or None if the cache can't be used.
+        """
+        if self.lazy_url or self.filter_on_parent:
+            parent = self.get_parent_value(selected_choices)
+            if parent is not None:
+                return [force_text(parent)]
+            if self.lazy_url:
+                return None
+        field = self.choices.field
+        parents = field.queryset.order_by() \
+            .values_list('%s_id' % field.related_model_name, flat=True) \
+            .distinct()
+        # The children without parent get their own group, first as on
+        # Python 2
+        return [force_text(parent) for parent in sorted(parents,
+            key=lambda parent: (parent is not None, parent))]
+
+    def render_parent_options(self, parents):
+        """
+        Returns a dict of the unselected options of the given parents.
+        """
+        field = self.choices.field
+        attname = '%s_id' % field.related_model_name
+        groups = {}
+        lookup = Q(**{'%s__in' % attname: [parent for parent in parents
+            if parent != 'None']})
+        if 'None' in parents:
+            lookup |= Q(**{'%s__isnull' % attname: True})
+        for obj in self.choices.queryset.filter(lookup):
+            option_value, option_label = self.choices.choice(obj)
+            groups.setdefault(force_text(option_value[1]), []).append(
+                self.render_option([], option_value, option_label))
+        return dict((parent, '\n'.join(options))
+            for parent, options in groups.items())
+
+    def get_cache_variant(self):
+        """
+        Returns what, besides the queryset, changes the rendered options.
+        """
+        field = self.choices.field
+        label = getattr(field.label_from_instance, '__func__',
+            field.label_from_instance)
+        return ':'.join(force_text(part) for part in (
+            _class_path(field.__class__), _class_path(self.__class__),
+            field.to_field_name, field.label_field,
+            '%s.%s' % (label.__module__, getattr(label, '__qualname__',
+                label.__name__))))
+
+    def render_cached_options(self, choices, selected_choices):
+        """
+        Renders the options from per parent fragments stored in the cache.
+
+        The fragments are rendered without selection which is patched
+        in afterward.
+        """
+        field = self.choices.field
+        try:
+            parents = self.get_cached_parents(selected_choices)
+            if parents is None:
+                return None
+            fragments = get_fragments(self.choices.queryset,
+                field.related_model_name, parents, self.render_parent_options,
+                self.get_cache_variant())
+        except (ValueError, ValidationError):
+            return None
+
+        selected_choices = self.normalize_selected_choices(selected_choices)
+        for value, parent in selected_choices:
+            option_value = escape(value)
+            related_option_str = escape('sub_%s' % parent)
+            option = '<option value="%s" class="%s">' % (
+                option_value, related_option_str)
+            if option in fragments.get(parent, ''):
+                fragments[parent] = fragments[parent].replace(option,
+                    '<option value="%s" selected="selected" class="%s">' % (
+                        option_value, related_option_str), 1)
+                if not self.allow_multiple_selected:
+                    break
+
+        output = []
+        if field.empty_label is not None:
+            output.append(self.render_option(
+                selected_choices, '', field.empty_label))
+        output.extend(fragments[parent] for parent in parents
+            if fragments.get(parent))
+        extra = self.render_choices(choices, selected_choices)
+        if extra:
+            output.append(extra)
         return '\n'.join(output)
 
+    def lazy_choices(self, selected_choices):
+        """
+        Returns the empty choice and the selected choices only, so that
+        the child queryset isn't scanned when the options are loaded lazily.
+        """
+        field = self.choices.field
+        choices = []
+        if field.empty_label is not None:
+            choices.append(('', field.empty_label))
+        values = [v[0] for v in selected_choices
+            if isinstance(v, (list, tuple)) and v[0] not in EMPTY_VALUES]
+        if values:
+            key = field.to_field_name or 'pk'
+            try:
+                objs = list(self.choices.queryset.filter(
+                    **{'%s__in' % key: values}))
+            except (ValueError, ValidationError):
+                objs = []
+            choices.extend(self.choices.choice(obj) for obj in objs)
+        return choices
+
     def render_option(self, selected_choices, option_value, option_label):
+        # Integer keys, the common case, don't need to be escaped
         if option_value:
             option_value, related_option_value = option_value
-            related_option_str = 'sub_%s' % related_option_value
+            if type(related_option_value) in INTEGER_TYPES:
+                related_option_value = '%d' % related_option_value
+                related_option_str = 'sub_' + related_option_value
+            else:
+                related_option_value = force_text(related_option_value)
+                related_option_str = escape('sub_' + related_option_value)
         else:
-            related_option_value = None
+            related_option_value = 'None'
             related_option_str = 'static'
-        option_value = force_text(option_value)
+        if type(option_value) in INTEGER_TYPES:
+            option_value = escaped_value = '%d' % option_value
+        else:
+            option_value = force_text(option_value)
+            escaped_value = escape(option_value)
 
-        option_tuple = (option_value, force_text(related_option_value))
+        option_tuple = (option_value, related_option_value)
         if option_tuple in selected_choices:
             selected_html = ' selected="selected"'
             if not self.allow_multiple_selected:
@@ -94,10 +789,18 @@ class RelatedSelect(forms.Select):
         else:
             selected_html = ''
 
-        value = '<option value="%s"%s class="%s">%s</option>' % (
-            escape(option_value), selected_html, escape(related_option_str),
-            conditional_escape(force_text(option_label)))
-        return value
+        return OPTION_HTML % (escaped_value, selected_html,
+            related_option_str, conditional_escape(force_text(option_label)))
+
+    def get_related_name(self, name):
+        """
+        Returns the html name of the parent field, with the same form
+        prefix as ``name``.
+        """
+        if '-' in name:
+            return '%s-%s' % (name.rsplit('-', 1)[0],
+                self.related_form_field_name)
+        return self.related_form_field_name
 
     def value_from_datadict(self, data, files, name):
         """
@@ -106,21 +809,125 @@ class RelatedSelect(forms.Select):
         """
         return (
             data.get(name, None),
-            data.get(self.related_form_field_name, None)
+            data.get(self.get_related_name(name), None)
         )
 
 
+class RelatedTypeahead(RelatedSelect):
+    """
+    Renders a search input next to a select holding the selected choice
+    only. The children of the selected parent are searched with
+    related_choice_field.views.RelatedSearchView at ``search_url``.
+    """
+
+    class Media:
+        extend = False
+        js = ('related_choice_field/js/related_typeahead.js',)
+
+    def __init__(self, search_url, attrs=None, choices=()):
+        super(RelatedTypeahead, self).__init__(attrs, choices)
+        self.search_url = search_url
+
+    @instrumented('render')
+    def render(self, name, value, attrs=None, choices=(), renderer=None):
+        if value is None: value = ''
+        final_attrs = build_attrs(self, attrs, name=name)
+        final_attrs.setdefault('id', 'id_%s' % name)
+        search_attrs = {
+            'type': 'search',
+            'autocomplete': 'off',
+            'data-related-parent': 'id_%s' % self.get_related_name(name),
+            'data-related-search': self.search_url,
+            'data-related-select': final_attrs['id'],
+        }
+        output = [
+            '<input%s />' % flatatt(search_attrs),
+            '<select%s>' % flatatt(final_attrs),
+        ]
+        options = self.render_options(choices, [value], name=name)
+        if options:
+            output.append(options)
+        output.append('</select>')
+        return mark_safe('\n'.join(output))
+
+    def get_base_choices(self, selected_choices):
+        return self.lazy_choices(selected_choices)
+
+
 class RelatedModelChoiceField(forms.ModelChoiceField):
     widget = RelatedSelect
+    # Keeps the "IN" lists below the database parameter limits
+    chunk_size = CHUNK_SIZE
+    # Objects fetched for a whole formset, see related_choice_field.forms
+    prefetched_choices = None
+    # Queryset of the copied field, cloned when first used, see __deepcopy__
+    _shared_queryset = None
 
     def __init__(self,
             related_form_field_name=None, related_model_name=None,
             *args, **kwargs):
         self.related_form_field_name = related_form_field_name
         self.related_model_name = related_model_name
+        self.lazy_url = kwargs.pop('lazy_url', None)
+        self.filter_on_parent = kwargs.pop('filter_on_parent', False)
+        self.cache_options = kwargs.pop('cache_options', False)
+        self.group_by_parent = kwargs.pop('group_by_parent', False)
+        self.omit_parents = kwargs.pop('omit_parents', ())
+        self.json_choices = kwargs.pop('json_choices', False)
+        self.only_fields = kwargs.pop('only_fields', None)
+        self.select_related_parent = kwargs.pop('select_related_parent', False)
+        self.label_field = kwargs.pop('label_field', None)
         super(RelatedModelChoiceField, self).__init__(*args, **kwargs)
         self.widget.related_form_field_name = self.related_form_field_name
+        self.widget.lazy_url = self.lazy_url
+        self.widget.filter_on_parent = self.filter_on_parent
+        self.widget.cache_options = self.cache_options
+        self.widget.group_by_parent = self.group_by_parent
+        self.widget.omit_parents = self.omit_parents
+        self.widget.json_choices = self.json_choices
+        if self.cache_options:
+            connect_invalidation(self.queryset.model, self.related_model_name)
+
+    def __deepcopy__(self, memo):
+        # Each form copies its fields: the configuration is shared and the
+        # queryset is only cloned if the form reads it
+        result = self.__class__.__new__(self.__class__)
+        result.__dict__.update(self.__dict__)
+        memo[id(self)] = result
+        result.widget = copy.deepcopy(self.widget, memo)
+        result.error_messages = self.error_messages.copy()
+        result.validators = self.validators[:]
+        # Copies of copies don't clone the queryset either
+        result._shared_queryset = self._queryset \
+            if self._queryset is not None else self._shared_queryset
+        result._queryset = None
+        result.widget.choices = result.choices
+        return result
+
+    def _get_queryset(self):
+        if self._queryset is None and self._shared_queryset is not None:
+            # A clone, so the forms don't share a result cache
+            self._queryset = self._shared_queryset.all()
+        return self._queryset
+
+    def _set_queryset(self, queryset):
+        self._shared_queryset = None
+        forms.ModelChoiceField.queryset.fset(self, queryset)
+
+    queryset = property(_get_queryset, _set_queryset)
 
+    def _get_choices(self):
+        if self.label_field is not None:
+            return RelatedValuesChoiceIterator(self)
+        if hasattr(self, '_choices'):
+            return self._choices
+        return RelatedModelChoiceIterator(self)
+
+    choices = property(_get_choices,
+        getattr(forms.ChoiceField, '_set_choices', None) or
+            forms.ChoiceField.choices.fset)
+
+    @instrumented('clean')
     def clean(self, value):
         """
         Validates the given value and returns its "cleaned" value as an
@@ -129,13 +936,112 @@ class RelatedModelChoiceField(forms.ModelChoiceField):
         Raises ValidationError for any errors.
         """
         value, related_value = value
-        value = super(RelatedModelChoiceField, self).clean(value)
-        if int(related_value) != \
-            getattr(value, '%s_id' % self.related_model_name):
-            raise ValidationError('Value does not match %s value.' %
-                (self.related_form_field_name,))
+        if value in EMPTY_VALUES:
+            return super(RelatedModelChoiceField, self).clean(value)
+        value = self.related_to_python(value, related_value)
+        self.validate(value)
+        self.run_validators(value)
         return value
 
+    def get_key_field(self):
+        meta = self.queryset.model._meta
+        if self.to_field_name:
+            return meta.get_field(self.to_field_name)
+        return meta.pk
+
+    def get_related_key_field(self):
+        """
+        Returns the model field the foreign key points to.
+        """
+        field = self.queryset.model._meta.get_field(self.related_model_name)
+        if hasattr(field, 'target_field'):
+            return field.target_field
+        return field.rel.get_related_field()
+
+    def related_to_python(self, value, related_value):
+        """
+        Returns the child object matching both the value and the related
+        value with a single query.
+        """
+        key = self.to_field_name or 'pk'
+        try:
+            related_value = self.get_related_key_field().to_python(
+                related_value)
+        except ValidationError:
+            related_value = None
+        try:
+            value = self.get_key_field().to_python(value)
+        except (ValueError, TypeError, ValidationError):
+            raise self.invalid_choice_error(value)
+        if self.prefetched_choices is not None:
+            return self.match_prefetched(value, related_value)
+        try:
+            if related_value is None:
+                raise self.queryset.model.DoesNotExist
+            return self.get_validation_queryset().get(**{
+                key: value,
+                '%s_id' % self.related_model_name: related_value,
+            })
+        except (ValueError, TypeError, ValidationError):
+            raise self.invalid_choice_error(value)
+        except self.queryset.model.DoesNotExist:
+            # Tell a wrong parent from a missing child on failure only
+            if self.queryset.filter(**{key: value}).exists():
+                raise self.mismatch_error()
+            raise self.invalid_choice_error(value)
+
+    def invalid_choice_error(self, value):
+        return ValidationError(self.error_messages['invalid_choice'],
+            code='invalid_choice', params={'value': value})
+
+    def mismatch_error(self):
+        return ValidationError('Value does not match %s value.' %
+            (self.related_form_field_name,))
+
+    def match_prefetched(self, value, related_value):
+        """
+        Same as related_to_python against the objects prefetched for a
+        whole formset, ``value`` being already converted.
+        """
+        obj = self.prefetched_choices.get(value)
+        if obj is None:
+            raise self.invalid_choice_error(value)
+        if getattr(obj, '%s_id' % self.related_model_name) != related_value:
+            raise self.mismatch_error()
+        return obj
+
+    def prefetch_choices(self, values):
+        """
+        Fetches the objects matching the given values with one query per
+        chunk and returns them by key.
+        """
+        key_field = self.get_key_field()
+        keys = set()
+        for value in values:
+            try:
+                keys.add(key_field.to_python(value))
+            except ValidationError:
+                pass
+        keys.discard(None)
+        key = self.to_field_name or 'pk'
+        objs = {}
+        for chunk in chunked(list(keys), self.chunk_size):
+            for obj in self.get_validation_queryset().filter(
+                    **{'%s__in' % key: chunk}):
+                objs[obj.serializable_value(key_field.name)] = obj
+        return objs
+
+    def get_validation_queryset(self):
+        queryset = self.queryset
+        if self.select_related_parent:
+            queryset = queryset.select_related(self.related_model_name)
+        if self.only_fields is not None:
+            fields = list(self.only_fields) + [self.related_model_name]
+            if self.to_field_name:
+                fields.append(self.to_field_name)
+            queryset = queryset.only(*fields)
+        return queryset
+
     def prepare_value(self, value):
         if hasattr(value, '_meta'):
             if self.to_field_name:
@@ -154,11 +1060,14 @@ class RelatedModelChoiceField(forms.ModelChoiceField):
 class MultipleRelatedSelect(RelatedSelect):
     allow_multiple_selected = True
 
-    def render(self, name, value, attrs=None, choices=()):
+    def get_data_attrs(self, name):
+        return {}
+
+    @instrumented('render')
+    def render(self, name, value, attrs=None, choices=(), renderer=None):
         if value is None:
             value = []
-        final_attrs = self.build_attrs(attrs, name=name)
-        output = ['<select multiple="multiple"%s>' % flatatt(final_attrs)]
+        output = [self.render_select_tag(name, attrs)]
         options = self.render_options(choices, value)
         if options:
             output.append(options)
@@ -170,12 +1079,16 @@ class MultipleRelatedSelect(RelatedSelect):
         Given a dictionary of data and this widget's name, returns the value
         of this widget. Returns None if it's not provided.
         """
-        related_value = data.get(self.related_form_field_name, None)
-        if isinstance(data, (MultiValueDict, MergeDict)):
+        related_value = data.get(self.get_related_name(name), None)
+        if hasattr(data, 'getlist'):
             return tuple([(item, related_value) for item in data.getlist(name)])
+        value = data.get(name, None)
+        if isinstance(value, (list, tuple)):
+            # A plain dict holding the list of values
+            return tuple([(item, related_value) for item in value])
 
         return (
-            data.get(name, None),
+            value,
             related_value
         )
 
@@ -190,6 +1103,7 @@ class RelatedModelMultipleChoiceField(RelatedModelChoiceField):
         'invalid_pk_value': _('"%s" is not a valid value for a primary key.')
     }
 
+    @instrumented('clean')
     def clean(self, value):
         """
         Validates the given value and returns its "cleaned" value as an
@@ -206,20 +1120,52 @@ class RelatedModelMultipleChoiceField(RelatedModelChoiceField):
         if not isinstance(value, (list, tuple)):
             raise ValidationError(self.error_messages['list'])
         key = self.to_field_name or 'pk'
-        for pk, related_pk in value:
-            try:
-                self.queryset.filter(**{key: pk})
-            except ValueError:
-                raise ValidationError(self.error_messages['invalid_pk_value'] % pk)
-        qs = self.queryset.filter(**{'%s__in' % key: [v[0] for v in value]})
-        pks = set([(force_text(getattr(o, key)), getattr(o, '%s_id' % self.related_model_name, None)) for o in qs])
+        key_field = self.get_key_field()
+
+        # Coerce all the values in a single pass
+        pairs = []
+        keys = []
+        seen = set()
         for val, related_pk in value:
-            if (force_text(val), int(related_pk)) not in pks:
+            try:
+                pk = key_field.to_python(val)
+            except (ValueError, TypeError, ValidationError):
+                raise ValidationError(self.error_messages['invalid_pk_value'] % val)
+            pairs.append((val, pk, related_pk))
+            if pk not in seen:
+                seen.add(pk)
+                keys.append(pk)
+
+        related_key_field = self.get_related_key_field()
+        objs = self.fetch_objects(key, keys)
+        attname = '%s_id' % self.related_model_name
+        related_pks = dict((self.get_key(obj), getattr(obj, attname))
+            for obj in objs)
+        for val, pk, related_pk in pairs:
+            try:
+                related_pk = related_key_field.to_python(related_pk)
+            except ValidationError:
+                raise ValidationError(self.error_messages['invalid_choice'] % val)
+            if pk not in related_pks or related_pks[pk] != related_pk:
                 raise ValidationError(self.error_messages['invalid_choice'] % val)
         # Since this overrides the inherited ModelChoiceField.clean
         # we run custom validators here
         self.run_validators(value)
-        return qs
+        return objs
+
+    def get_key(self, obj):
+        if self.to_field_name:
+            return obj.serializable_value(self.to_field_name)
+        return obj.pk
+
+    def fetch_objects(self, key, keys):
+        """
+        Returns the list of the selected objects, fetched chunk by chunk.
+        """
+        objs = []
+        for chunk in chunked(keys, self.chunk_size):
+            objs.extend(self.queryset.filter(**{'%s__in' % key: chunk}))
+        return objs
 
     def prepare_value(self, value):
         if hasattr(value, '__iter__'):
@@ -227,3 +1173,38 @@ class RelatedModelMultipleChoiceField(RelatedModelChoiceField):
                 super(RelatedModelMultipleChoiceField, self).prepare_value(v)
                 for v in value]
         return super(RelatedModelMultipleChoiceField, self).prepare_value(value)
+
+
+class RelatedParentChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField for the parent of RelatedModelChoiceField.
+
+    In a form using related_choice_field.forms.RelatedChoiceFormMixin, the
+    submitted parent and child are validated together with one query.
+    With ``hide_empty_parents`` the parents without children are left out
+    and both selects are rendered from a single query on the children.
+    """
+    # Objects fetched along with the child, see related_choice_field.forms
+    prefetched_choices = None
+
+    def __init__(self, *args, **kwargs):
+        self.hide_empty_parents = kwargs.pop('hide_empty_parents', False)
+        super(RelatedParentChoiceField, self).__init__(*args, **kwargs)
+
+    def get_key_field(self):
+        meta = self.queryset.model._meta
+        if self.to_field_name:
+            return meta.get_field(self.to_field_name)
+        return meta.pk
+
+    def to_python(self, value):
+        if self.prefetched_choices is not None and \
+                value not in EMPTY_VALUES:
+            try:
+                obj = self.prefetched_choices.get(
+                    self.get_key_field().to_python(value))
+            except ValidationError:
+                obj = None
+            if obj is not None:
+                return obj
+        return super(RelatedParentChoiceField, self).to_python(value)
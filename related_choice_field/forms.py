@@ -0,0 +1,222 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.core.exceptions import ValidationError
+from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
+from django.core.validators import EMPTY_VALUES
+from django.forms.formsets import BaseFormSet
+
+from .fields import RelatedModelChoiceField, RelatedModelMultipleChoiceField
+from .fields import RelatedParentChoiceField, RelatedValuesChoiceIterator
+from .fields import SharedChoiceIterator, PairedChoiceIterator
+from .fields import ParentChoiceIterator
+from .compat import force_text
+
+
+class RelatedChoiceFormMixin(object):
+    """
+    Form mixin that lets the related fields know the parent value of the
+    form, bound or initial, so they render the relevant children only.
+
+    It also validates the levels of a cascade together, see
+    prefetch_related_chain, and renders a RelatedParentChoiceField with
+    ``hide_empty_parents`` from the query of its child.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RelatedChoiceFormMixin, self).__init__(*args, **kwargs)
+        for name, field in self.fields.items():
+            if isinstance(field, RelatedModelChoiceField):
+                field.widget.parent_value = self.get_related_parent_value(
+                    field.related_form_field_name)
+                self.pair_related_choices(field)
+
+    def pair_related_choices(self, field):
+        parent_field = self.fields.get(field.related_form_field_name)
+        if not isinstance(parent_field, RelatedParentChoiceField) or \
+                not parent_field.hide_empty_parents or \
+                isinstance(field, RelatedModelMultipleChoiceField) or \
+                isinstance(field.choices, RelatedValuesChoiceIterator):
+            return
+        children = PairedChoiceIterator(field.widget.choices, parent_field)
+        field.widget.choices = children
+        parent_field.widget.choices = ParentChoiceIterator(
+            parent_field, children)
+
+    def full_clean(self):
+        if self.is_bound:
+            for chain in self.get_related_chains():
+                self.prefetch_related_chain(chain)
+        super(RelatedChoiceFormMixin, self).full_clean()
+
+    def get_related_chains(self):
+        """
+        Returns the names of the fields of every cascade spanning more than
+        one relation, or ending with a RelatedParentChoiceField, from the
+        last level up to the root field.
+        """
+        related = dict((name, field) for name, field in self.fields.items()
+            if isinstance(field, RelatedModelChoiceField) and
+                not isinstance(field, RelatedModelMultipleChoiceField))
+        parents = set(field.related_form_field_name
+            for field in related.values())
+        chains = []
+        for name in related:
+            if name in parents:
+                continue
+            chain = [name]
+            while chain[-1] in related:
+                parent = related[chain[-1]].related_form_field_name
+                if parent in chain:
+                    break
+                chain.append(parent)
+            if len(chain) > 2 or isinstance(self.fields.get(chain[-1]),
+                    RelatedParentChoiceField):
+                chains.append(chain)
+        return chains
+
+    def prefetch_related_chain(self, chain):
+        """
+        Checks a whole cascade with a single query on its last level and
+        hands the objects of every level to their fields, the root field
+        included when it is a RelatedParentChoiceField.
+
+        Nothing is prefetched if the chain isn't consistent, so each field
+        reports its own error.
+        """
+        levels = [self.fields[name] for name in chain[:-1]]
+        root = self.fields.get(chain[-1])
+        if not isinstance(root, RelatedParentChoiceField):
+            root = None
+        values = [field.widget.value_from_datadict(
+                self.data, self.files, self.add_prefix(name))
+            for name, field in zip(chain, levels)]
+        if any(value in EMPTY_VALUES for value in values[0]):
+            return
+        leaf = levels[0]
+        lookups = {leaf.to_field_name or 'pk': values[0][0]}
+        path = []
+        queryset = leaf.get_validation_queryset()
+        for i, field in enumerate(levels):
+            path.append(field.related_model_name)
+            if i + 1 < len(levels):
+                parent_field = levels[i + 1]
+                value = values[i + 1][0]
+            else:
+                parent_field = root
+                value = values[i][1]
+            # The parent querysets may restrict the choices
+            if parent_field is not None and parent_field.queryset.query.where:
+                queryset = queryset.filter(**{
+                    '%s__in' % '__'.join(path): parent_field.queryset})
+            if value in EMPTY_VALUES:
+                return
+            key = parent_field and parent_field.to_field_name or 'pk'
+            lookups['%s__%s' % ('__'.join(path), key)] = value
+        try:
+            obj = queryset.select_related(
+                '__'.join(path if root is not None else path[:-1])) \
+                .get(**lookups)
+        except (ValueError, TypeError, ValidationError,
+                ObjectDoesNotExist, MultipleObjectsReturned):
+            return
+        for i, field in enumerate(levels):
+            key_name = field.get_key_field().name
+            field.prefetched_choices = {obj.serializable_value(key_name): obj}
+            if i + 1 < len(levels) or root is not None:
+                obj = getattr(obj, field.related_model_name)
+        if root is not None:
+            key_name = root.get_key_field().name
+            root.prefetched_choices = {obj.serializable_value(key_name): obj}
+
+    def get_related_parent_value(self, name):
+        parent_field = self.fields.get(name)
+        if parent_field is None:
+            return None
+        if self.is_bound:
+            return parent_field.widget.value_from_datadict(
+                self.data, self.files, self.add_prefix(name))
+        value = self.initial.get(name, parent_field.initial)
+        if callable(value):
+            value = value()
+        return parent_field.prepare_value(value)
+
+
+def queryset_key(queryset):
+    """
+    Returns a key that only querysets selecting the same rows share.
+    """
+    try:
+        return force_text(queryset.query)
+    except Exception:
+        # Empty querysets can't be turned into SQL
+        return id(queryset)
+
+
+def share_related_choices(forms, shared=None):
+    """
+    Makes the related fields of the given forms render from the same
+    evaluated choices, so the queryset is evaluated once for all of them.
+
+    Returns the dict of shared choices by field name and queryset, which
+    can be passed again to share them with more forms.
+    """
+    if shared is None:
+        shared = {}
+    for form in forms:
+        for name, field in form.fields.items():
+            if not isinstance(field, RelatedModelChoiceField):
+                continue
+            # Forms restricting their own queryset keep their choices
+            key = (name, queryset_key(field.queryset))
+            if key not in shared:
+                shared[key] = SharedChoiceIterator(field.widget.choices)
+            field.widget.choices = shared[key]
+    return shared
+
+
+class RelatedChoiceFormSetMixin(object):
+    """
+    Formset mixin that validates the related choices of all its forms
+    with one query per field instead of one query per form and renders
+    them from choices evaluated once.
+    """
+
+    def _construct_form(self, i, **kwargs):
+        form = super(RelatedChoiceFormSetMixin, self)._construct_form(
+            i, **kwargs)
+        shared = self.__dict__.setdefault('_shared_related_choices', {})
+        share_related_choices([form], shared)
+        return form
+
+    def full_clean(self):
+        if self.is_bound:
+            self.prefetch_related_choices()
+        super(RelatedChoiceFormSetMixin, self).full_clean()
+
+    def prefetch_related_choices(self):
+        forms = self.forms
+        if not forms:
+            return
+        for name, field in forms[0].fields.items():
+            if not isinstance(field, RelatedModelChoiceField) or \
+                    isinstance(field, RelatedModelMultipleChoiceField):
+                continue
+            # Forms may restrict their own querysets: they only share the
+            # objects fetched with the same one
+            groups = {}
+            for form in forms:
+                if name in form.fields:
+                    groups.setdefault(queryset_key(form.fields[name].queryset),
+                        []).append(form)
+            for group in groups.values():
+                values = [
+                    form.fields[name].widget.value_from_datadict(
+                        form.data, form.files, form.add_prefix(name))[0]
+                    for form in group]
+                objs = group[0].fields[name].prefetch_choices(values)
+                for form in group:
+                    form.fields[name].prefetched_choices = objs
+
+
+class BaseRelatedChoiceFormSet(RelatedChoiceFormSetMixin, BaseFormSet):
+    pass
@@ -0,0 +1,117 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import threading
+import timeit
+from functools import wraps
+
+from django.db import connection
+from django.dispatch import Signal
+
+
+# Sent after an instrumented operation with the keyword arguments
+# ``instance``, ``operation``, ``duration`` (wall time in seconds),
+# ``option_count``, ``bytes``, ``queries``, ``cache_hits`` and
+# ``exception``, the exception raised by the operation if any, such as
+# the ValidationError of a failed clean. The values that can't be
+# measured are None.
+measured = Signal()
+
+_local = threading.local()
+
+
+def record_cache_hits(hits):
+    """
+    Adds cache hits to the operations being measured, if any.
+    """
+    for measurement in getattr(_local, 'measurements', ()):
+        measurement['cache_hits'] = (measurement['cache_hits'] or 0) + hits
+
+
+class QueryCounter(object):
+    """
+    Counts the queries run on the default connection.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        if hasattr(connection, 'execute_wrapper'):
+            # Django >= 2.0
+            self.wrapper = connection.execute_wrapper(self.count_query)
+            self.wrapper.__enter__()
+        else:
+            self.wrapper = None
+            self.debug_attribute = 'force_debug_cursor' \
+                if hasattr(connection, 'force_debug_cursor') \
+                else 'use_debug_cursor'
+            self.debug_cursor = getattr(connection, self.debug_attribute)
+            setattr(connection, self.debug_attribute, True)
+            self.start = len(connection.queries)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.wrapper is not None:
+            self.wrapper.__exit__(exc_type, exc_value, traceback)
+        else:
+            self.count = len(connection.queries) - self.start
+            setattr(connection, self.debug_attribute, self.debug_cursor)
+
+    def count_query(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def instrumented(operation):
+    """
+    Decorates a render or clean method to send the ``measured`` signal.
+
+    Nothing is measured while the signal has no receiver.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not measured.receivers:
+                return method(self, *args, **kwargs)
+            return measure(operation, method, self, args, kwargs)
+        return wrapper
+    return decorator
+
+
+def measure(operation, method, instance, args, kwargs):
+    measurement = {'cache_hits': None}
+    if not hasattr(_local, 'measurements'):
+        _local.measurements = []
+    _local.measurements.append(measurement)
+    result = exception = None
+    queries = QueryCounter()
+    start = timeit.default_timer()
+    try:
+        with queries:
+            result = method(instance, *args, **kwargs)
+    except Exception as e:
+        exception = e
+        raise
+    finally:
+        duration = timeit.default_timer() - start
+        # The nested measurements are done first
+        _local.measurements.pop()
+        if operation == 'clean':
+            value = args[0] if args else kwargs.get('value')
+            if not value:
+                option_count = 0
+            elif isinstance(value[0], (list, tuple)):
+                option_count = len(value)
+            else:
+                option_count = 1
+            size = None
+        elif result is not None:
+            option_count = result.count('<option')
+            size = len(result.encode('utf-8'))
+        else:
+            option_count = size = None
+        measured.send(sender=instance.__class__, instance=instance,
+            operation=operation, duration=duration,
+            option_count=option_count, bytes=size, queries=queries.count,
+            cache_hits=measurement['cache_hits'], exception=exception)
+    return result
@@ -0,0 +1,72 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import csv
+import io
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from related_choice_field.bulk import validate_pairs
+from related_choice_field.compat import force_text, import_string
+
+
+class Command(BaseCommand):
+    help = ('Checks the (parent, child) rows of a CSV file against a '
+        'RelatedModelChoiceField, given as the dotted path of its form and '
+        'its name, and writes the invalid rows.')
+    args = '<form_class> <field_name> <csv_file>'
+
+    if getattr(BaseCommand, 'option_list', None) is not None:
+        # Django < 1.10
+        option_list = BaseCommand.option_list + (
+            make_option('--chunk-size', type='int', dest='chunk_size'),
+            make_option('--workers', type='int', dest='workers', default=0),
+            make_option('--delimiter', dest='delimiter', default=','),
+            make_option('--skip-header', action='store_true',
+                dest='skip_header', default=False),
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('args', nargs=3,
+            metavar=('form_class', 'field_name', 'csv_file'))
+        parser.add_argument('--chunk-size', type=int, dest='chunk_size',
+            help='rows checked with each query')
+        parser.add_argument('--workers', type=int, dest='workers', default=0,
+            help='threads running the queries while the file is read')
+        parser.add_argument('--delimiter', dest='delimiter', default=',')
+        parser.add_argument('--skip-header', action='store_true',
+            dest='skip_header', default=False)
+
+    def handle(self, *args, **options):
+        if len(args) != 3:
+            raise CommandError('Usage: %s' % self.args)
+        form_class, field_name, path = args
+        try:
+            field = import_string(form_class).base_fields[field_name]
+        except (ImportError, KeyError) as e:
+            raise CommandError('Unknown field %s.%s: %s' %
+                (form_class, field_name, e))
+
+        invalid = 0
+        with self.open(path) as rows:
+            reader = csv.reader(rows, delimiter=str(options['delimiter']))
+            if options['skip_header']:
+                next(reader, None)
+            # Short rows are reported as missing their child
+            pairs = (tuple(force_text(value) for value in (row + ['', ''])[:2])
+                for row in reader)
+            writer = csv.writer(self.stdout, lineterminator='\n')
+            for index, (parent, child), error in validate_pairs(field, pairs,
+                    options.get('chunk_size'), options.get('workers') or 0):
+                if error is not None:
+                    invalid += 1
+                    writer.writerow([index, parent, child,
+                        '; '.join(error.messages)])
+        if invalid:
+            raise CommandError('%i invalid rows.' % invalid)
+
+    def open(self, path):
+        if sys.version_info[0] < 3:
+            return open(path, 'rb')
+        return io.open(path, newline='', encoding='utf-8')
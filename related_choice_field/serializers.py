@@ -0,0 +1,114 @@
+"""
+Django REST Framework counterpart of RelatedModelChoiceField.
+
+Requires djangorestframework, which is why it lives in its own module.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+from rest_framework.fields import empty
+
+from .fields import CHUNK_SIZE, RelatedModelChoiceField
+
+
+class RelatedPrimaryKeyField(serializers.RelatedField):
+    """
+    Serializer field for a child whose ``related_model_name`` foreign key
+    must match the value of the ``related_field_name`` field of the same
+    serializer, validated with the rules of RelatedModelChoiceField.
+
+    Used in a serializer whose list serializer is RelatedListSerializer,
+    a whole list is validated with one query per chunk of children.
+    """
+    chunk_size = CHUNK_SIZE
+    # Objects fetched for a whole list, see RelatedListSerializer
+    prefetched_choices = None
+    default_error_messages = {
+        'does_not_exist': 'Invalid pk "{pk_value}" - object does not exist.',
+        'incorrect_type': 'Incorrect type. Expected pk value, received '
+            '{data_type}.',
+        'mismatch': 'Value does not match {related_field_name} value.',
+    }
+
+    def __init__(self, related_field_name=None, related_model_name=None,
+            **kwargs):
+        self.related_field_name = related_field_name
+        self.related_model_name = related_model_name
+        self.to_field_name = kwargs.pop('to_field_name', None)
+        self.only_fields = kwargs.pop('only_fields', None)
+        super(RelatedPrimaryKeyField, self).__init__(**kwargs)
+
+    def get_form_field(self):
+        """
+        Returns the RelatedModelChoiceField holding the validation rules.
+        """
+        if not hasattr(self, '_form_field'):
+            self._form_field = RelatedModelChoiceField(
+                related_form_field_name=self.related_field_name,
+                related_model_name=self.related_model_name,
+                queryset=self.get_queryset(),
+                to_field_name=self.to_field_name,
+                only_fields=self.only_fields)
+            self._form_field.chunk_size = self.chunk_size
+        return self._form_field
+
+    def get_value(self, dictionary):
+        value = super(RelatedPrimaryKeyField, self).get_value(dictionary)
+        if value is empty or value in ('', None):
+            # Left to the usual required and null checks
+            return value
+        return value, dictionary.get(self.related_field_name)
+
+    def prefetch(self, data):
+        """
+        Fetches the children submitted in the ``data`` list of mappings.
+        """
+        self.prefetched_choices = self.get_form_field().prefetch_choices(
+            [item.get(self.field_name) for item in data
+                if hasattr(item, 'get')])
+
+    def to_internal_value(self, data):
+        value, related_value = data if isinstance(data, tuple) \
+            else (data, None)
+        form_field = self.get_form_field()
+        try:
+            form_field.get_key_field().to_python(value)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(value).__name__)
+        form_field.prefetched_choices = self.prefetched_choices
+        try:
+            return form_field.related_to_python(value, related_value)
+        except (TypeError, ValueError):
+            self.fail('does_not_exist', pk_value=value)
+        except DjangoValidationError as e:
+            if e.code == 'invalid_choice':
+                self.fail('does_not_exist', pk_value=value)
+            self.fail('mismatch', related_field_name=self.related_field_name)
+
+    def to_representation(self, value):
+        if self.to_field_name:
+            return value.serializable_value(self.to_field_name)
+        return value.pk
+
+
+class RelatedListSerializer(serializers.ListSerializer):
+    """
+    ListSerializer fetching the children of the RelatedPrimaryKeyField
+    fields of all the items at once, the errors still being reported per
+    item. Use it as the ``list_serializer_class`` of the item serializer.
+    """
+
+    def to_internal_value(self, data):
+        fields = []
+        if isinstance(data, list):
+            fields = [field for field in self.child.fields.values()
+                if isinstance(field, RelatedPrimaryKeyField)
+                and not field.read_only]
+        for field in fields:
+            field.prefetch(data)
+        try:
+            return super(RelatedListSerializer, self).to_internal_value(data)
+        finally:
+            for field in fields:
+                field.prefetched_choices = None
@@ -0,0 +1,171 @@
+/*
+ * Cascading selects for related_choice_field.
+ *
+ * A child <select> declares its parent through data-related-parent (the
+ * parent element id). Its options, or its <optgroup> elements when they are
+ * grouped by parent, are indexed by parent once, from their sub_<parent>
+ * class, so that changing the parent only swaps one group of elements.
+ * With data-related-url the options of a parent are fetched as JSON the
+ * first time that parent is selected. With data-related-choices they are
+ * built from the JSON embedded in the page, a parent at a time.
+ */
+(function (window, document) {
+    'use strict';
+
+    var PARENT_CLASS = /(?:^|\s)sub_(\S+)/;
+
+    function trigger(element, name) {
+        var event = document.createEvent('HTMLEvents');
+        event.initEvent(name, true, false);
+        element.dispatchEvent(event);
+    }
+
+    function RelatedSelect(child, parent) {
+        this.child = child;
+        this.parent = parent;
+        this.url = child.getAttribute('data-related-url');
+        // Options of each parent, indexed once
+        this.groups = {};
+        // Options of the parent currently displayed
+        this.current = [];
+        this.pending = null;
+        // Choices by parent embedded as JSON, built when first displayed
+        this.data = null;
+        var source = document.getElementById(
+            child.getAttribute('data-related-choices'));
+        if (source) {
+            this.data = JSON.parse(source.textContent);
+        }
+
+        var selected = child.value;
+        var elements = Array.prototype.slice.call(
+            child.querySelectorAll('option, optgroup'));
+        for (var i = 0; i < elements.length; i++) {
+            var element = elements[i];
+            var match = PARENT_CLASS.exec(element.className);
+            // The options of a group move along with it
+            if (!match || (element.parentNode !== child &&
+                    PARENT_CLASS.test(element.parentNode.className))) {
+                continue;
+            }
+            if (!this.groups.hasOwnProperty(match[1])) {
+                this.groups[match[1]] = [];
+            }
+            this.groups[match[1]].push(element);
+            element.parentNode.removeChild(element);
+        }
+
+        var self = this;
+        parent.addEventListener('change', function () {
+            self.show(parent.value, '');
+        }, false);
+
+        // In lazy mode the options of a known parent may not be rendered
+        if (this.url && parent.value && !this.groups.hasOwnProperty(parent.value)) {
+            this.show(parent.value, selected);
+        } else {
+            this.display(parent.value, this.data ? selected : null);
+        }
+    }
+
+    RelatedSelect.prototype.show = function (parentValue, selectedValue) {
+        if (this.url && parentValue && !this.groups.hasOwnProperty(parentValue)) {
+            this.display('', null);
+            this.load(parentValue, selectedValue);
+        } else {
+            this.pending = null;
+            this.display(parentValue, selectedValue);
+            trigger(this.child, 'change');
+        }
+    };
+
+    RelatedSelect.prototype.option = function (choice, parentValue) {
+        var option = document.createElement('option');
+        option.value = choice[0];
+        option.text = choice[1];
+        option.className = 'sub_' + parentValue;
+        return option;
+    };
+
+    RelatedSelect.prototype.materialize = function (parentValue) {
+        if (!this.data || !this.data.hasOwnProperty(parentValue)) {
+            return;
+        }
+        var choices = this.data[parentValue];
+        var group = [];
+        for (var i = 0; i < choices.length; i++) {
+            group.push(this.option(choices[i], parentValue));
+        }
+        // Replaces the selected options rendered in the page
+        this.groups[parentValue] = group;
+        delete this.data[parentValue];
+    };
+
+    RelatedSelect.prototype.display = function (parentValue, selectedValue) {
+        var i;
+        this.materialize(parentValue);
+        for (i = 0; i < this.current.length; i++) {
+            this.current[i].parentNode.removeChild(this.current[i]);
+        }
+        this.current = this.groups[parentValue] || [];
+
+        var fragment = document.createDocumentFragment();
+        for (i = 0; i < this.current.length; i++) {
+            fragment.appendChild(this.current[i]);
+        }
+        this.child.appendChild(fragment);
+        if (selectedValue !== null) {
+            this.child.value = selectedValue;
+        }
+    };
+
+    RelatedSelect.prototype.load = function (parentValue, selectedValue) {
+        var self = this;
+        var request = new XMLHttpRequest();
+        var separator = this.url.indexOf('?') === -1 ? '?' : '&';
+        this.pending = request;
+        request.open('GET', this.url + separator + 'parent=' +
+            encodeURIComponent(parentValue), true);
+        request.onreadystatechange = function () {
+            if (request.readyState !== 4 || request.status !== 200) {
+                return;
+            }
+            var choices = JSON.parse(request.responseText);
+            var group = [];
+            for (var i = 0; i < choices.length; i++) {
+                group.push(self.option(choices[i], parentValue));
+            }
+            self.groups[parentValue] = group;
+            // Discard answers for a parent that is no longer selected
+            if (self.pending === request) {
+                self.pending = null;
+                self.display(parentValue, selectedValue);
+                trigger(self.child, 'change');
+            }
+        };
+        request.send(null);
+    };
+
+    function init(root) {
+        var selects = (root || document).querySelectorAll(
+            'select[data-related-parent]');
+        for (var i = 0; i < selects.length; i++) {
+            var child = selects[i];
+            var parent = document.getElementById(
+                child.getAttribute('data-related-parent'));
+            if (parent && !child.relatedSelect) {
+                child.relatedSelect = new RelatedSelect(child, parent);
+            }
+        }
+    }
+
+    window.relatedSelect = {init: init};
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', function () {
+            init(document);
+        }, false);
+    } else {
+        init(document);
+    }
+})(window, document);
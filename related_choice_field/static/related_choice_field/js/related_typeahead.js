@@ -0,0 +1,136 @@
+/*
+ * Typeahead for related_choice_field.
+ *
+ * A search input declares the parent element (data-related-parent), the
+ * search url (data-related-search) and the select it fills
+ * (data-related-select). Typing searches the children of the selected
+ * parent; the last option loads the next page with the cursor returned by
+ * the server.
+ */
+(function (window, document) {
+    'use strict';
+
+    var DELAY = 250;
+
+    function trigger(element, name) {
+        var event = document.createEvent('HTMLEvents');
+        event.initEvent(name, true, false);
+        element.dispatchEvent(event);
+    }
+
+    function Typeahead(input, select, parent) {
+        this.input = input;
+        this.select = select;
+        this.parent = parent;
+        this.url = input.getAttribute('data-related-search');
+        this.pending = null;
+        this.timeout = null;
+        this.more = null;
+
+        var self = this;
+        input.addEventListener('input', function () {
+            window.clearTimeout(self.timeout);
+            self.timeout = window.setTimeout(function () {
+                self.search(null);
+            }, DELAY);
+        }, false);
+        parent.addEventListener('change', function () {
+            input.value = '';
+            self.clear();
+            trigger(select, 'change');
+        }, false);
+        select.addEventListener('change', function () {
+            if (self.more && self.more.selected) {
+                self.search(self.more.getAttribute('data-cursor'));
+            }
+        }, false);
+    }
+
+    Typeahead.prototype.clear = function () {
+        this.pending = null;
+        this.more = null;
+        while (this.select.options.length) {
+            this.select.remove(0);
+        }
+    };
+
+    Typeahead.prototype.search = function (cursor) {
+        if (!this.parent.value) {
+            return;
+        }
+        var self = this;
+        var request = new XMLHttpRequest();
+        var separator = this.url.indexOf('?') === -1 ? '?' : '&';
+        var url = this.url + separator + 'parent=' +
+            encodeURIComponent(this.parent.value) + '&q=' +
+            encodeURIComponent(this.input.value);
+        if (cursor) {
+            url += '&after=' + encodeURIComponent(cursor);
+        }
+        this.pending = request;
+        request.open('GET', url, true);
+        request.onreadystatechange = function () {
+            if (request.readyState !== 4 || request.status !== 200 ||
+                    self.pending !== request) {
+                return;
+            }
+            self.pending = null;
+            self.display(JSON.parse(request.responseText), cursor !== null);
+        };
+        request.send(null);
+    };
+
+    Typeahead.prototype.display = function (page, append) {
+        if (append && this.more) {
+            this.select.removeChild(this.more);
+        } else {
+            this.clear();
+        }
+        var fragment = document.createDocumentFragment();
+        var parentClass = 'sub_' + this.parent.value;
+        for (var i = 0; i < page.results.length; i++) {
+            var option = document.createElement('option');
+            option.value = page.results[i][0];
+            option.text = page.results[i][1];
+            option.className = parentClass;
+            fragment.appendChild(option);
+        }
+        this.more = null;
+        if (page.next) {
+            this.more = document.createElement('option');
+            this.more.value = '';
+            this.more.text = '…';
+            this.more.setAttribute('data-cursor', JSON.stringify(page.next));
+            fragment.appendChild(this.more);
+        }
+        this.select.appendChild(fragment);
+        if (!append) {
+            trigger(this.select, 'change');
+        }
+    };
+
+    function init(root) {
+        var inputs = (root || document).querySelectorAll(
+            'input[data-related-search]');
+        for (var i = 0; i < inputs.length; i++) {
+            var input = inputs[i];
+            var select = document.getElementById(
+                input.getAttribute('data-related-select'));
+            var parent = document.getElementById(
+                input.getAttribute('data-related-parent'));
+            if (select && parent && !input.relatedTypeahead) {
+                input.relatedTypeahead = new Typeahead(input, select, parent);
+            }
+        }
+    }
+
+    window.relatedTypeahead = {init: init};
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', function () {
+            init(document);
+        }, false);
+    } else {
+        init(document);
+    }
+})(window, document);
@@ -0,0 +1,186 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import json
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import HttpResponseNotModified
+from django.views.generic import View
+
+from .cache import connect_invalidation, get_table_etag
+from .compat import force_text, url
+from .fields import iterate_queryset
+
+
+class RelatedChoicesView(View):
+    """
+    Returns the choices of a RelatedModelChoiceField that belong to one
+    parent as a JSON list of ``[value, label]`` pairs.
+
+    The parent id is read from the ``parent`` GET parameter and the
+    queryset is filtered on ``<related_model_name>_id`` so the foreign key
+    index is used.
+    """
+    field = None
+    parent_parameter = 'parent'
+
+    def get(self, request, *args, **kwargs):
+        parent = request.GET.get(self.parent_parameter)
+        if not parent:
+            return HttpResponseBadRequest()
+        try:
+            choices = self.get_choices(parent)
+        except (ValueError, ValidationError):
+            return HttpResponseBadRequest()
+        return HttpResponse(json.dumps(choices),
+            content_type='application/json')
+
+    def get_choices(self, parent):
+        iterator = self.field.choices
+        queryset = iterator.queryset.filter(
+            **{'%s_id' % self.field.related_model_name: parent})
+        choices = []
+        for obj in queryset:
+            (value, related_value), label = iterator.choice(obj)
+            choices.append([force_text(value), force_text(label)])
+        return choices
+
+
+class RelatedSearchView(RelatedChoicesView):
+    """
+    Searches the choices of one parent by label and returns a page of
+    ``[value, label]`` pairs with the cursor of the next page as JSON.
+
+    The pages are sorted on the search field and the key and use keyset
+    pagination: the ``after`` GET parameter is the JSON cursor returned
+    with the previous page, so deep pages don't need an OFFSET.
+    """
+    search_field = None
+    search_lookup = 'istartswith'
+    search_parameter = 'q'
+    cursor_parameter = 'after'
+    page_size = 20
+
+    def get(self, request, *args, **kwargs):
+        parent = request.GET.get(self.parent_parameter)
+        if not parent:
+            return HttpResponseBadRequest()
+        term = request.GET.get(self.search_parameter, '')
+        after = request.GET.get(self.cursor_parameter)
+        try:
+            if after:
+                after = json.loads(after)
+            results, cursor = self.search(parent, term, after or None)
+        except (ValueError, TypeError, ValidationError):
+            return HttpResponseBadRequest()
+        return HttpResponse(json.dumps({'results': results, 'next': cursor}),
+            content_type='application/json')
+
+    def get_search_field(self):
+        search_field = self.search_field or self.field.label_field
+        if not search_field:
+            raise ImproperlyConfigured('%s needs a search_field or a field '
+                'with a label_field.' % self.__class__.__name__)
+        return search_field
+
+    def search(self, parent, term, after=None):
+        field = self.field
+        key = field.to_field_name or 'pk'
+        search_field = self.get_search_field()
+        queryset = field.queryset.filter(
+            **{'%s_id' % field.related_model_name: parent})
+        if term:
+            queryset = queryset.filter(
+                **{'%s__%s' % (search_field, self.search_lookup): term})
+        if after is not None:
+            label, value = after
+            queryset = queryset.filter(
+                Q(**{'%s__gt' % search_field: label}) |
+                Q(**{search_field: label, '%s__gt' % key: value}))
+        rows = list(queryset.order_by(search_field, key)
+            .values_list(key, search_field)[:self.page_size + 1])
+        cursor = None
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            cursor = [force_text(rows[-1][1]), force_text(rows[-1][0])]
+        results = [[force_text(value), force_text(label)]
+            for value, label in rows]
+        return results, cursor
+
+
+class RelatedChoicesMapView(View):
+    """
+    Returns all the choices of a RelatedModelChoiceField as a JSON object
+    of ``[value, label]`` pairs by parent value.
+
+    The response carries an ETag built from the version of the children
+    table (see related_choice_field.cache) so a matching If-None-Match is
+    answered with a 304 without reading the children. Changes made without
+    the save and delete signals, such as ``QuerySet.update``, are not seen.
+
+    The version is only dropped from the cache of the process saving the
+    child: with several processes, the default cache must be shared by
+    all of them (memcached, redis, database...), otherwise the others keep
+    answering 304 for stale choices until the version expires.
+    """
+    field = None
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag()
+        if self.etag_matches(etag, request.META.get('HTTP_IF_NONE_MATCH')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(json.dumps(self.get_choices_map(),
+                separators=(',', ':')), content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+    def get_etag(self):
+        return get_table_etag(self.field.choices.queryset,
+            self.field.related_model_name)
+
+    def etag_matches(self, etag, header):
+        if not header:
+            return False
+        etags = [e.strip() for e in header.split(',')]
+        return '*' in etags or etag in etags or ('W/' + etag) in etags
+
+    def get_choices_map(self):
+        iterator = self.field.choices
+        choices = {}
+        for obj in iterate_queryset(iterator.queryset, self.field.chunk_size):
+            (value, related_value), label = iterator.choice(obj)
+            choices.setdefault(force_text(related_value), []).append(
+                [force_text(value), force_text(label)])
+        return choices
+
+
+def related_choices_url(regex, form_class, field_name, name=None):
+    """
+    Returns an url pattern serving the lazy choices of the
+    ``field_name`` field declared on ``form_class``.
+    """
+    field = form_class.base_fields[field_name]
+    return url(regex, RelatedChoicesView.as_view(field=field), name=name)
+
+
+def related_search_url(regex, form_class, field_name, name=None,
+        **initkwargs):
+    """
+    Returns an url pattern searching the choices of the ``field_name``
+    field declared on ``form_class``.
+    """
+    field = form_class.base_fields[field_name]
+    return url(regex, RelatedSearchView.as_view(field=field, **initkwargs),
+        name=name)
+
+
+def related_choices_map_url(regex, form_class, field_name, name=None):
+    """
+    Returns an url pattern serving all the choices of the ``field_name``
+    field declared on ``form_class`` by parent.
+    """
+    field = form_class.base_fields[field_name]
+    connect_invalidation(field.queryset.model, field.related_model_name)
+    return url(regex, RelatedChoicesMapView.as_view(field=field), name=name)
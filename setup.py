@@ -31,6 +31,9 @@ according to a foreign key contraint.',
     long_description=__doc__,
     license='BSD',
     packages=find_packages(exclude=['demo']),
+    package_data={
+        'related_choice_field': ['static/related_choice_field/js/*.js'],
+    },
     zip_safe=False,
     install_requires=install_requires,
     tests_require=tests_require,
@@ -40,6 +43,8 @@ according to a foreign key contraint.',
     classifiers=[
         'Development Status :: 4 - Beta',
         'Framework :: Django',
+        'Framework :: Django :: 4.2',
+        'Framework :: Django :: 5.1',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: BSD License',
         'Operating System :: OS Independent',
@@ -49,5 +54,6 @@ according to a foreign key contraint.',
         'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3.2',
         'Programming Language :: Python :: 3.3',
+        'Programming Language :: Python :: 3.11',
     ],
 )